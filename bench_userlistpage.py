@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+##
+# bench_userlistpage.py
+###
+"""bench_userlistpage.py
+
+Benchmarks the two ways userlistpage can list users: scraping
+Special:ListUsers a page at a time (in one go, and split into ranges fetched
+side by side), and api.php's list=allusers. Both run
+against a local stand-in wiki that can be made slow. Prints one JSON object
+per result. It also times building the user objects themselves, and
+reckons up how much memory each one takes.
+
+Usage: bench_userlistpage.py [--sizes=1000,10000,...] [--latency=seconds]
+    [--pagesize=n] [--shards=n] [--records=100000,...] [--repeat=n]
+    [--output=file]
+
+"""
+
+__version__ = "0.1"
+__author__ = "Danny O'Brien <http://www.spesh.com/danny/>"
+__copyright__ = "Copyright Danny O'Brien"
+__contributors__ = None
+__license__ = "GPL v3"
+
+import time
+import json
+import urlparse
+import unittest
+
+from pywikipediabot import wikipedia
+import userlistpage
+import httppool
+
+options = {'sizes': [1000, 10000], 'latency': 0.05, 'pagesize': 500,
+        'shards': 8, 'records': [100000], 'repeat': 3, 'output': None}
+
+LIST_PAGE = '''<html><head><title>User list</title></head><body>
+<div id="content"><div class="mw-spcontent">
+<form method="get" action="/index.php"><fieldset>
+<input name="username" /></fieldset></form>
+%s
+<ul>
+%s
+</ul>
+%s
+</div></div></body></html>'''
+
+
+class StubWiki(userlistpage.StubApi):
+    """ StubApi, plus an /index.php that lists the same users the way
+    Special:ListUsers does, `limit` at a time from `offset` or `username`.
+    Everything waits `latency` seconds before answering. """
+    latency = 0
+
+    def list_page(self, q):
+        limit = int(q.get('limit', 50))
+        if 'offset' in q:
+            offset = int(q['offset'])
+        else:
+            offset = len([i for i in range(self.users)
+                if 'User%05d' % i < q.get('username', '')])
+        names = ['User%05d' % i for i in range(offset,
+            min(offset + limit, self.users))]
+        items = ['<li><a href="/wiki/User:%s"%s title="User:%s">%s</a> '
+                '(Created on 22 June 2012 at 08:52)</li>' %
+                (n, int(n[4:]) % 2 and ' class="new"' or '', n, n)
+                for n in names]
+        nav = ''
+        if offset + limit < self.users:
+            nav = ('<a href="/index.php?title=Special:ListUsers&amp;limit=%d'
+                    '&amp;offset=%d" class="mw-nextlink">next %d</a>' %
+                    (limit, offset + limit, limit))
+        return LIST_PAGE % (nav, '\n'.join(items), nav)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if not self.path.startswith('/index.php'):
+            return userlistpage.StubApi.do_GET(self)
+        q = dict(urlparse.parse_qsl(urlparse.urlsplit(self.path).query))
+        body = self.list_page(q)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def timed(f):
+    """ (seconds, number of items) for the fastest of the runs of f. """
+    best = None
+    for i in range(options['repeat']):
+        start = time.time()
+        n = len(list(f()))
+        t = time.time() - start
+        if best is None or t < best[0]:
+            best = (t, n)
+    return best
+
+
+def shards(n):
+    """ Boundaries that split User00000... into options['shards'] ranges. """
+    return [''] + ['User%05d' % (i * n / options['shards'])
+            for i in range(1, options['shards'])]
+
+
+def bench_list(site, base, n):
+    StubWiki.users = n
+    html_url = base + ('/index.php?title=Special:ListUsers&limit=%d' %
+            options['pagesize'])
+    results = []
+    for (backend, f) in [
+            ('html', lambda: userlistpage.iter_users_from_url(site, html_url)),
+            ('html-sharded', lambda: userlistpage.iter_users_sharded(site,
+                shards(n), workers=options['shards'],
+                url=base + '/index.php?title=Special:ListUsers')),
+            ('api', lambda: userlistpage.iter_api_users(site,
+                url=base + '/api.php'))]:
+        (t, count) = timed(f)
+        results.append({'benchmark': 'list_users', 'backend': backend,
+            'users': count, 'latency': StubWiki.latency, 'seconds': t})
+    return results
+
+
+def footprint(o):
+    """ Bytes taken by o itself, and its __dict__ if it has one. """
+    size = sys.getsizeof(o)
+    if hasattr(o, '__dict__'):
+        size += sys.getsizeof(o.__dict__)
+    return size
+
+
+def bench_records(site, n):
+    results = []
+    for (kind, cls) in [('UserRecord', userlistpage.UserRecord),
+            ('UserFromUserList', userlistpage.UserFromUserList)]:
+        def build():
+            users = []
+            for i in xrange(n):
+                u = cls(site, 'User%05d' % i)
+                u.forceUserPage(i % 2 == 0)
+                users.append(u)
+            return users
+        (t, count) = timed(build)
+        sample = cls(site, 'User00000')
+        sample.forceUserPage(True)
+        results.append({'benchmark': 'build_users', 'kind': kind,
+            'users': count, 'seconds': t, 'bytes_each': footprint(sample)})
+    return results
+
+
+class StubWikiLists(unittest.TestCase):
+    def setUp(self):
+        (self.server, self.base) = httppool.stub_server(StubWiki)
+        self.site = wikipedia.Site('en')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_bothBackendsListTheSameUsers(self):
+        StubWiki.users = 120
+        html = userlistpage.iter_users_from_url(self.site,
+                self.base + '/index.php?title=Special:ListUsers&limit=50')
+        api = userlistpage.iter_api_users(self.site,
+                url=self.base + '/api.php')
+        self.assertEqual([u.name() for u in html], [u.name() for u in api])
+
+    def test_shardsListTheSameUsers(self):
+        StubWiki.users = 120
+        sharded = userlistpage.iter_users_sharded(self.site,
+                ['', 'User00007', 'User00050'],
+                url=self.base + '/index.php?title=Special:ListUsers')
+        self.assertEqual([u.name() for u in sharded],
+                ['User%05d' % i for i in range(120)])
+
+
+def emit(out, result):
+    out.write(json.dumps(result, sort_keys=True) + '\n')
+    out.flush()
+
+
+def main(args):
+    out = sys.stdout
+    if options['output']:
+        out = open(options['output'], 'a')
+    StubWiki.latency = options['latency']
+    (server, base) = httppool.stub_server(StubWiki)
+    site = wikipedia.getSite()
+    try:
+        for n in options['records']:
+            for result in bench_records(site, n):
+                emit(out, result)
+        for n in options['sizes']:
+            for result in bench_list(site, base, n):
+                emit(out, result)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+import sys
+import getopt
+
+
+class Main():
+    """ Encapsulates option handling. Subclass to add new options,
+        add 'handle_x' method for an -x option,
+        add 'handle_xlong' method for an --xlong option
+        help (-h, --help) should be automatically created from module
+        docstring and handler docstrings.
+        test (-t, --test) will run all docstring and unittests it finds
+        options listed in takes_argument expect a value (--x=value)
+        """
+    takes_argument = ['sizes', 'latency', 'pagesize', 'shards', 'records',
+            'repeat', 'output']
+
+    class Usage(Exception):
+        """ Use this to generate a Usage message """
+        def __init__(self, msg):
+            self.msg = msg
+
+    def __init__(self):
+        handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
+        self.shortopts = ''.join([i + ':' * (i in self.takes_argument)
+            for i in handlers if len(i) == 1])
+        self.longopts = [i + '=' * (i in self.takes_argument)
+            for i in handlers if (len(i) > 1)]
+
+    def handler(self, option):
+        i = 'handle_%s' % option.lstrip('-').rstrip('=:')
+        if hasattr(self, i):
+            return getattr(self, i)
+
+    def default_main(self, args):
+        print sys.argv[0], " called with ", args
+
+    def handle_help(self, v):
+        """ Shows this message """
+        print sys.modules.get(__name__).__doc__
+        descriptions = {}
+        for i in list(self.shortopts.replace(':', '')) + self.longopts:
+            d = self.handler(i).__doc__
+            if d in descriptions:
+                descriptions[d].append(i)
+            else:
+                descriptions[d] = [i]
+        for d, opts in descriptions.iteritems():
+            for i in opts:
+                if len(i) == 1:
+                    print '-%s' % i,
+                else:
+                    print '--%s' % i,
+            print
+            print d
+        sys.exit(0)
+    handle_h = handle_help
+
+    def handle_test(self, v):
+        """ Runs test suite for file """
+        import doctest
+        import unittest
+        suite = unittest.defaultTestLoader.loadTestsFromModule(
+                sys.modules.get(__name__))
+        suite.addTest(doctest.DocTestSuite())
+        runner = unittest.TextTestRunner()
+        runner.run(suite)
+        sys.exit(0)
+    handle_t = handle_test
+
+    def handle_sizes(self, v):
+        """ Numbers of users to list (comma separated) """
+        options['sizes'] = [int(i) for i in v.split(',') if i]
+
+    def handle_latency(self, v):
+        """ Seconds the stand-in wiki waits before answering (default 0.05) """
+        options['latency'] = float(v)
+
+    def handle_pagesize(self, v):
+        """ Users per Special:ListUsers page (default 500) """
+        options['pagesize'] = int(v)
+
+    def handle_shards(self, v):
+        """ Ranges to split the list into, all fetched at once (default 8) """
+        options['shards'] = int(v)
+
+    def handle_records(self, v):
+        """ Numbers of user objects to build (comma separated) """
+        options['records'] = [int(i) for i in v.split(',') if i]
+
+    def handle_repeat(self, v):
+        """ Runs of each benchmark; the fastest is reported (default 3) """
+        options['repeat'] = int(v)
+
+    def handle_output(self, v):
+        """ Append results to this file instead of printing them """
+        options['output'] = v
+    def run(self, main=None, argv=None):
+        """ Execute main function, having stripped out options and called the
+        responsible handler functions within the class. Main defaults to
+        listing the remaining arguments.
+        """
+        if not callable(main):
+            main = self.default_main
+        if argv is None:
+            argv = sys.argv
+        try:
+            try:
+                opts, args = getopt.getopt(argv[1:],
+                        self.shortopts, self.longopts)
+            except getopt.error, msg:
+                raise self.Usage(msg)
+            for o, a in opts:
+                (self.handler(o))(a)
+            return main(args)
+        except self.Usage, err:
+            print >>sys.stderr, err.msg
+            self.handle_help(None)
+            return 2
+
+if __name__ == "__main__":
+    sys.exit(Main().run(main) or 0)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+##
+# bench_www_watch.py
+###
+"""bench_www_watch.py
+
+Benchmarks for www_watch. Times parsing and writing out synthetic watchlist
+tables of various sizes, then runs the fetch loop against a local stub server
+that can be slow, send etags or not, and answer conditional requests with 304s
+or not. Prints one JSON object per result, to keep track of regressions.
+
+Usage: bench_www_watch.py [--sizes=10,100,...] [--fetchsizes=10,100,...]
+    [--latency=seconds] [--workers=n] [--repeat=n] [--output=file]
+
+"""
+
+__version__ = "0.1"
+__author__ = "Danny O'Brien <http://www.spesh.com/danny/>"
+__copyright__ = "Copyright Danny O'Brien"
+__contributors__ = None
+__license__ = "GPL v3"
+
+import time
+import json
+import BaseHTTPServer
+import unittest
+
+import www_watch
+import httppool
+
+options = {'sizes': [10, 100, 1000, 10000, 100000],
+        'fetchsizes': [10, 100, 1000], 'latency': 0.01, 'workers': 8,
+        'repeat': 3, 'output': None}
+
+LAST_MODIFIED = 'Fri, 22 Jun 2012 08:52:12 GMT'
+
+
+def synthetic_table(n, base='http://example.com', etag='', last_modified=''):
+    """ Watchlist markup with n rows, pointing at base/page/0 onwards. """
+    lines = ['{| class="wikitable"', '|-', '! URL', '! Etag',
+            '! Last Modified']
+    for i in range(n):
+        lines.extend(['|-', '| %s/page/%d' % (base, i), '| ' + etag,
+            '| ' + last_modified])
+    lines.append('|}')
+    return '\n'.join(lines)
+
+
+class StubPages(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves /page/n after a delay of `latency` seconds. Sends an ETag and
+    Last-Modified if `validators` is set, and honours If-None-Match and
+    If-Modified-Since if `not_modified` is set too. """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0
+    validators = True
+    not_modified = True
+
+    def respond(self, body):
+        time.sleep(self.latency)
+        etag = '"%s"' % self.path
+        if self.validators and self.not_modified and (
+                self.headers.get('If-None-Match') == etag or
+                self.headers.get('If-Modified-Since') == LAST_MODIFIED):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        return body
+
+    def do_GET(self):
+        body = self.respond('Page %s ' % self.path * 200)
+        if body:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.respond('Page %s ' % self.path * 200)
+
+    def log_message(self, *args):
+        pass
+
+
+def best_of(repeat, f):
+    """ Fastest of `repeat` runs of f, in seconds. """
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def bench_table(n):
+    markup = synthetic_table(n, etag='abc', last_modified=LAST_MODIFIED)
+    wt = www_watch.WikiTable(markup)
+    rows = wt.wiki_to_dict()
+    results = []
+    results.append(('wiki_to_dict', best_of(options['repeat'],
+        lambda: www_watch.WikiTable(markup).wiki_to_dict())))
+    results.append(('_stringify', best_of(options['repeat'],
+        lambda: www_watch.WikiTable._stringify(rows, wt.header, wt.fields,
+            wt.real_fields))))
+    results.append(('copy_with_new_dict', best_of(options['repeat'],
+        lambda: wt.copy_with_new_dict(rows))))
+    return [{'benchmark': name, 'rows': n, 'seconds': t}
+            for (name, t) in results]
+
+
+def bench_fetch(n, base, mode):
+    """ Runs the www_watch fetch loop over n rows. mode is 'fresh' (the
+    table has no validators yet), '304' (it has them and the server honours
+    them) or 'noetag' (the server has no validators, so bodies get hashed).
+    """
+    StubPages.validators = (mode != 'noetag')
+    StubPages.not_modified = (mode == '304')
+    if mode == '304':
+        markup = synthetic_table(n, base, last_modified=LAST_MODIFIED)
+    else:
+        markup = synthetic_table(n, base)
+    www_watch.options['workers'] = options['workers']
+    www_watch.options['perhost'] = options['workers']
+    times = []
+    for i in range(options['repeat']):
+        www_watch.transport = httppool.Pool(timeout=60)
+        www_watch.breaker = www_watch.Breaker()
+        wt = www_watch.WikiTable(markup, key='url')
+        start = time.time()
+        results = www_watch.update_tables([wt])
+        times.append(time.time() - start)
+        stats = www_watch.transport.stats
+        www_watch.transport.close()
+    return {'benchmark': 'fetch', 'mode': mode, 'rows': n,
+            'latency': StubPages.latency, 'workers': options['workers'],
+            'seconds': min(times), 'requests': stats['requests'],
+            'connections': stats['connections'], 'reused': stats['reused'],
+            'bytes': stats['bytes'],
+            'ok': len([c for c in results if c.status == 'ok'])}
+
+
+class SyntheticTables(unittest.TestCase):
+    def test_tablesHaveTheRightNumberOfRows(self):
+        wt = www_watch.WikiTable(synthetic_table(25), key='url')
+        self.assertEqual(len(wt.wiki_to_dict()), 25)
+        self.assertNotEqual(wt.get_row('http://example.com/page/24'), None)
+
+    def test_fetchLoopGets304s(self):
+        (server, base) = httppool.stub_server(StubPages)
+        repeat = options['repeat']
+        try:
+            options['repeat'] = 1
+            r = bench_fetch(5, base, '304')
+        finally:
+            options['repeat'] = repeat
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(r['ok'], 5)
+        self.assertEqual(r['requests'], 5)
+        self.assertEqual(r['bytes'], 0)
+
+
+def emit(out, result):
+    out.write(json.dumps(result, sort_keys=True) + '\n')
+    out.flush()
+
+
+def main(args):
+    out = sys.stdout
+    if options['output']:
+        out = open(options['output'], 'a')
+    for n in options['sizes']:
+        for result in bench_table(n):
+            emit(out, result)
+    StubPages.latency = options['latency']
+    (server, base) = httppool.stub_server(StubPages)
+    try:
+        for n in options['fetchsizes']:
+            for mode in ('fresh', '304', 'noetag'):
+                emit(out, bench_fetch(n, base, mode))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+import sys
+import getopt
+
+
+class Main():
+    """ Encapsulates option handling. Subclass to add new options,
+        add 'handle_x' method for an -x option,
+        add 'handle_xlong' method for an --xlong option
+        help (-h, --help) should be automatically created from module
+        docstring and handler docstrings.
+        test (-t, --test) will run all docstring and unittests it finds
+        options listed in takes_argument expect a value (--x=value)
+        """
+    takes_argument = ['sizes', 'fetchsizes', 'latency', 'workers', 'repeat',
+            'output']
+
+    class Usage(Exception):
+        """ Use this to generate a Usage message """
+        def __init__(self, msg):
+            self.msg = msg
+
+    def __init__(self):
+        handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
+        self.shortopts = ''.join([i + ':' * (i in self.takes_argument)
+            for i in handlers if len(i) == 1])
+        self.longopts = [i + '=' * (i in self.takes_argument)
+            for i in handlers if (len(i) > 1)]
+
+    def handler(self, option):
+        i = 'handle_%s' % option.lstrip('-').rstrip('=:')
+        if hasattr(self, i):
+            return getattr(self, i)
+
+    def default_main(self, args):
+        print sys.argv[0], " called with ", args
+
+    def handle_help(self, v):
+        """ Shows this message """
+        print sys.modules.get(__name__).__doc__
+        descriptions = {}
+        for i in list(self.shortopts.replace(':', '')) + self.longopts:
+            d = self.handler(i).__doc__
+            if d in descriptions:
+                descriptions[d].append(i)
+            else:
+                descriptions[d] = [i]
+        for d, opts in descriptions.iteritems():
+            for i in opts:
+                if len(i) == 1:
+                    print '-%s' % i,
+                else:
+                    print '--%s' % i,
+            print
+            print d
+        sys.exit(0)
+    handle_h = handle_help
+
+    def handle_test(self, v):
+        """ Runs test suite for file """
+        import doctest
+        import unittest
+        suite = unittest.defaultTestLoader.loadTestsFromModule(
+                sys.modules.get(__name__))
+        suite.addTest(doctest.DocTestSuite())
+        runner = unittest.TextTestRunner()
+        runner.run(suite)
+        sys.exit(0)
+    handle_t = handle_test
+
+    def handle_sizes(self, v):
+        """ Table sizes to time parsing and writing for (comma separated) """
+        options['sizes'] = [int(i) for i in v.split(',') if i]
+
+    def handle_fetchsizes(self, v):
+        """ Table sizes to run the fetch loop over (comma separated) """
+        options['fetchsizes'] = [int(i) for i in v.split(',') if i]
+
+    def handle_latency(self, v):
+        """ Seconds the stub server waits before answering (default 0.01) """
+        options['latency'] = float(v)
+
+    def handle_workers(self, v):
+        """ Fetch workers for the fetch loop (default 8) """
+        options['workers'] = int(v)
+
+    def handle_repeat(self, v):
+        """ Runs of each benchmark; the fastest is reported (default 3) """
+        options['repeat'] = int(v)
+
+    def handle_output(self, v):
+        """ Append results to this file instead of printing them """
+        options['output'] = v
+
+    def run(self, main=None, argv=None):
+        """ Execute main function, having stripped out options and called the
+        responsible handler functions within the class. Main defaults to
+        listing the remaining arguments.
+        """
+        if not callable(main):
+            main = self.default_main
+        if argv is None:
+            argv = sys.argv
+        try:
+            try:
+                opts, args = getopt.getopt(argv[1:],
+                        self.shortopts, self.longopts)
+            except getopt.error, msg:
+                raise self.Usage(msg)
+            for o, a in opts:
+                (self.handler(o))(a)
+            return main(args)
+        except self.Usage, err:
+            print >>sys.stderr, err.msg
+            self.handle_help(None)
+            return 2
+
+if __name__ == "__main__":
+    sys.exit(Main().run(main) or 0)
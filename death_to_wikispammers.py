@@ -5,12 +5,27 @@
 ###
 """death_to_wikispammers
 
-Usage: death_to_wikispammers [username]
+Usage: death_to_wikispammers [--index=file] [--journal=file] [--ahead=n]
+    [--deleters=n] [--rate=deletes/second] [username]
  Downloads a list of recently created users, starting at the username given.
  One by one, shows their user page via STDOUT.
  Delete user page and block for spam? it asks, [y/n]
  If yes, deletes user page, blocks user for spamming
  If no, goes onto next
+ Users are kept in the local user index (see userindex.py), so the next run
+ only downloads users created since, and skips anyone already reviewed.
+ Every delete and block is noted in a journal (see journal.py) as it's
+ planned and done, so if a run stops half way through despamming someone,
+ the next one finishes the job without asking again.
+ While you're deciding about one user, the next few (--ahead, default 5) are
+ being looked up in the background, so the next question comes straight
+ away.
+ Despamming blocks the user at the same time as deleting their pages. If the
+ wiki has Special:Nuke, all the pages go in one request; whatever it didn't
+ delete (or everything, if there's no Nuke) is deleted page by page, several
+ at once (--deleters), but no faster than --rate a second. Afterwards it says
+ how many pages went. Anyone who couldn't be blocked, or whose pages couldn't
+ all be deleted, is tried again on the next run.
 
 """
 
@@ -20,14 +35,283 @@ __copyright__ = "Copyright Danny O'Brien"
 __contributors__ = None
 __license__ = "GPL v3"
 
+import itertools
+import collections
+import time
+import os
+import tempfile
+import shutil
+import StringIO
+import unittest
+
 from pywikipediabot import wikipedia
-from userlistpage import user_list_since_user
+from userlistpage import with_block_status
+import userindex
+import wikisession
+import journal
+import workpool
+
+# Kept apart from merge_blocked_users' journal: see journal.py
+JOURNAL = os.path.expanduser('~/.secretaribot_despam_journal')
+
+options = {'index': userindex.DEFAULT_INDEX, 'journal': JOURNAL, 'ahead': 5,
+        'deleters': 4, 'rate': 2.0}
+
+REASON = "Spam (deleted by [Secretaribot] )"
+BLOCK_REASON = "Spam: deleted by [Secretaribot]"
+PREVIEW = 800
+
+Review = collections.namedtuple('Review', 'blocked contributions user_page')
+
+
+def look_up(site, user):
+    """ Everything we need to decide about user, fetched in one go so it can
+    be done ahead of time: whether they're blocked and, if they're not,
+    everything they've edited (newest first) and their user page. """
+    if user.isBlocked():
+        return Review(True, [], None)
+    contributions = list(user.contributions())
+    user_page = None
+    if user.hadUserPage():
+        try:
+            user_page = wikipedia.Page(site, 'User:' + user.name()).get()
+        except (wikipedia.NoPage, wikipedia.IsRedirectPage):
+            pass
+    return Review(False, contributions, user_page)
+
+
+def already(*codes):
+    """ For Journal.once: API errors that mean it was done already. """
+    return lambda e: isinstance(e, wikisession.APIError) and e.args[0] in codes
+
+
+def despam(actions, done, user, contributions=None):
+    """ Deletes every page user edited, and blocks them at the same time,
+    skipping anything the journal says has already been done and picking up
+    any deletes it says are unfinished. The pages go to Special:Nuke in one
+    go if the wiki has it; anything Nuke didn't delete (or everything, if
+    there's no Nuke) is deleted one by one, several at a time. Returns a
+    summary of what happened. """
+    name = user.name()
+    if contributions is None:
+        contributions = user.contributions()
+    titles = []
+    for each_page in contributions:
+        title = each_page[0].title()
+        if title not in titles and not done.is_done(name, 'delete', title):
+            titles.append(title)
+    for title in done.pending(name, 'delete'):
+        if title not in titles:
+            titles.append(title)
+    limiter = workpool.RateLimiter(options['rate'])
+    summary = {'deleted': 0, 'nuked': 0, 'failed': 0, 'blocked': False,
+            'start': time.time()}
+
+    def nuke(titles):
+        """ Returns the titles Nuke didn't delete. """
+        for title in titles:
+            done.plan(name, 'delete', title)
+        gone = actions.nuke(name, titles, REASON)
+        for title in gone:
+            done.done(name, 'delete', title, nuked=True)
+        return [title for title in titles if title not in gone]
+
+    def run((job, arg)):
+        if job == 'block':
+            done.once(name, 'block', lambda: actions.block(name,
+                BLOCK_REASON, expiry="infinite", autoblock=True,
+                allowusertalk=False, anononly=False),
+                finished=already('alreadyblocked'))
+        elif job == 'nuke':
+            return nuke(arg)
+        else:
+            limiter.wait()
+            done.once(name, 'delete', lambda: actions.delete(arg, REASON),
+                    arg, already('missingtitle'))
+
+    jobs = [('block', None)]
+    if titles and actions.has_extension('Nuke'):
+        jobs.append(('nuke', titles))
+    else:
+        jobs.extend([('delete', title) for title in titles])
+    while jobs:
+        retry = []
+        for ((job, arg), result, error) in workpool.imap_unordered(run, jobs,
+                workers=options['deleters']):
+            if job == 'nuke':
+                if error:
+                    print "Special:Nuke didn't work:", error
+                    result = arg
+                summary['nuked'] += len(arg) - len(result)
+                summary['deleted'] += len(arg) - len(result)
+                if result:
+                    print "Deleting %d pages one by one" % len(result)
+                retry = [('delete', title) for title in result]
+            elif error:
+                print "Couldn't %s %s: %s" % (job, arg or name, error)
+                if job == 'delete':
+                    summary['failed'] += 1
+            elif job == 'block':
+                summary['blocked'] = True
+            else:
+                summary['deleted'] += 1
+        jobs = retry
+    summary['seconds'] = time.time() - summary['start']
+    return summary
+
+
+def report(name, summary):
+    return "%s: %d pages deleted (%d by Special:Nuke), %d failed, %s " \
+            "(%.1fs)" % (name, summary['deleted'], summary['nuked'],
+                    summary['failed'],
+                    summary['blocked'] and 'blocked' or 'NOT blocked',
+                    summary['seconds'])
+
+
+def unfinished(done, name):
+    """ Whether the journal says we started despamming name, but didn't get
+    it all done. Only deletes and blocks count: anything else in the
+    journal is some other script's business. """
+    return done.started(name, ('delete', 'block')) and (
+            not done.is_done(name, 'block') or
+            done.pending(name, 'delete') != [])
+
+
+def finish(index, name, summary):
+    """ Says how despamming name went and, if it all worked, notes them as
+    blocked and reviewed. If it didn't, the next run picks up where this one
+    left off. """
+    print report(name, summary)
+    if summary['blocked'] and not summary['failed']:
+        index.set_blocked(name)
+        index.mark(name, 'reviewed')
+    index.commit()
+
+
+class StubPage:
+    def __init__(self, title):
+        self._title = title
+
+    def title(self):
+        return self._title
+
+
+class StubUser:
+    def __init__(self, name, titles=()):
+        self._name = name
+        self.titles = titles
+
+    def name(self):
+        return self._name
+
+    def contributions(self):
+        return [(StubPage(t), 1, '2012-06-22T08:52:12Z', 'Spam')
+                for t in self.titles]
+
+
+class StubActions:
+    """ The WikiActions despam uses. Nuke leaves anything in `undeletable`
+    alone; blocks fail if `block_fails` is set. """
+    def __init__(self, nuke=True, undeletable=(), block_fails=False):
+        self.extensions = nuke and ['Nuke'] or []
+        self.undeletable = undeletable
+        self.block_fails = block_fails
+        self.deleted = []
+        self.nuked = []
+        self.blocked = []
+
+    def has_extension(self, name):
+        return name in self.extensions
+
+    def nuke(self, user, titles, reason):
+        self.nuked.append(list(titles))
+        return [t for t in titles if t not in self.undeletable]
+
+    def delete(self, title, reason):
+        self.deleted.append(title)
+
+    def block(self, user, reason, **flags):
+        if self.block_fails:
+            raise wikisession.APIError('permissiondenied', 'No')
+        self.blocked.append(user)
+
+
+class Despam(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.done = journal.Journal(os.path.join(self.dir, 'journal'))
+        self.rate = options['rate']
+        options['rate'] = None
+        self.spammer = StubUser('Spammer', ['Spam', 'More spam', 'Spam'])
+        sys.stdout, self.stdout = StringIO.StringIO(), sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        options['rate'] = self.rate
+        self.done.close()
+        shutil.rmtree(self.dir)
+
+    def test_nukesEverythingAtOnce(self):
+        actions = StubActions()
+        summary = despam(actions, self.done, self.spammer)
+        self.assertEqual(actions.nuked, [['Spam', 'More spam']])
+        self.assertEqual(actions.deleted, [])
+        self.assertEqual(actions.blocked, ['Spammer'])
+        self.assertEqual((summary['deleted'], summary['nuked'],
+            summary['failed'], summary['blocked']), (2, 2, 0, True))
+        self.assertFalse(unfinished(self.done, 'Spammer'))
+
+    def test_deletesWhatNukeLeftOneByOne(self):
+        actions = StubActions(undeletable=['More spam'])
+        summary = despam(actions, self.done, self.spammer)
+        self.assertEqual(actions.deleted, ['More spam'])
+        self.assertEqual((summary['deleted'], summary['nuked']), (2, 1))
+        self.assertTrue(self.done.is_done('Spammer', 'delete', 'More spam'))
+
+    def test_deletesOneByOneWithoutNuke(self):
+        actions = StubActions(nuke=False)
+        summary = despam(actions, self.done, self.spammer)
+        self.assertEqual(actions.nuked, [])
+        self.assertEqual(sorted(actions.deleted), ['More spam', 'Spam'])
+        self.assertEqual((summary['deleted'], summary['nuked']), (2, 0))
+
+    def test_resumesAHalfFinishedRun(self):
+        self.done.done('Spammer', 'block')
+        self.done.done('Spammer', 'delete', 'Spam')
+        self.done.plan('Spammer', 'delete', 'Gone from contributions')
+        self.assertTrue(unfinished(self.done, 'Spammer'))
+        actions = StubActions(nuke=False)
+        despam(actions, self.done, self.spammer)
+        self.assertEqual(sorted(actions.deleted),
+                ['Gone from contributions', 'More spam'])
+        self.assertFalse(unfinished(self.done, 'Spammer'))
+
+    def test_otherActionsDontCountAsStarted(self):
+        self.done.plan('Someone', 'merge')
+        self.assertFalse(unfinished(self.done, 'Someone'))
+
+    def test_failedBlocksAreLeftUnfinished(self):
+        summary = despam(StubActions(block_fails=True), self.done,
+                self.spammer)
+        self.assertFalse(summary['blocked'])
+        self.assertTrue(unfinished(self.done, 'Spammer'))
+
+    def test_reportSaysWhatHappened(self):
+        summary = {'deleted': 3, 'nuked': 2, 'failed': 1, 'blocked': False,
+                'seconds': 1.25}
+        self.assertEqual(report('Spammer', summary), 'Spammer: 3 pages '
+                'deleted (2 by Special:Nuke), 1 failed, NOT blocked (1.2s)')
 
 
 def main(args):
     noisebridge = wikipedia.Site('en')
+    session = wikisession.shared(noisebridge, sysop=True)
+    actions = wikisession.WikiActions(noisebridge, session=session)
+    index = userindex.UserIndex(options['index'])
+    done = journal.Journal(options['journal'])
     if len(args) > 0:
         lastUser = args[0]
+        index.set_cursor(lastUser)
     else:
         try:
             f = open("/tmp/death_to_wikispammers_last_spammer","r")
@@ -36,34 +320,42 @@ def main(args):
         except IOError:
             lastUser = 'Zephyr'
 
-    users = user_list_since_user(noisebridge, lastUser).getUsers()
+    users = with_block_status(noisebridge, itertools.chain(
+        index.records(noisebridge, without=['reviewed']),
+        userindex.sync_users(noisebridge, index, lastUser)))
 
-    for i in users:
+    reviews = workpool.prefetch(lambda user: look_up(noisebridge, user),
+            users, options['ahead'])
+    for (i, review, error) in reviews:
         print ">>> ", i.name()
-        hasContributions = False
-        if i.isBlocked():
+        if error:
+            print "Couldn't look them up:", error
             continue
-        try:
-            m = i.contributions(limit=1).next()
-            print "Last edit:", m
-            hasContributions = True
-        except StopIteration:
-            pass
-        if hasContributions:
+        if unfinished(done, i.name()):
+            print "Finishing off despamming"
+            finish(index, i.name(), despam(actions, done, i,
+                review.contributions))
+            continue
+        if review.blocked or done.is_done(i.name(), 'block'):
+            index.set_blocked(i.name())
+            index.mark(i.name(), 'reviewed')
+            continue
+        if review.user_page:
+            print review.user_page[:PREVIEW]
+        if review.contributions:
+            print "Last edit:", review.contributions[0]
             decision = raw_input("Spam? [y/N]")
             if decision.upper() != "Y":
+                index.mark(i.name(), 'reviewed')
+                index.commit()
                 continue
         print "Despamming"
-        for each_page in i.contributions():
-            print each_page
-            each_page[0].delete("Spam (deleted by [Secretaribot] )",
-                    prompt=False)
-        i.block(reason="Spam: deleted by [Secretaribot]",
-                expiry="infinite", onAutoblock=True,
-                allowUsertalk=False, anon=False)
-        f = open("/tmp/death_to_wikispammers_last_spammer","w")
-        f.write(i.name())
-        f.close()
+        finish(index, i.name(), despam(actions, done, i,
+            review.contributions))
+    index.close()
+    done.compact()
+    done.close()
+    print session.report()
 
 
 import sys
@@ -77,7 +369,10 @@ class Main():
         help (-h, --help) should be automatically created from module
         docstring and handler docstrings.
         test (-t, --test) will run all docstring and unittests it finds
+        options listed in takes_argument expect a value (--x=value)
         """
+    takes_argument = ['index', 'journal', 'ahead', 'deleters', 'rate']
+
     class Usage(Exception):
         """ Use this to generate a Usage message """
         def __init__(self, msg):
@@ -85,11 +380,13 @@ class Main():
 
     def __init__(self):
         handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
-        self.shortopts = ''.join([i for i in handlers if len(i) == 1])
-        self.longopts = [i for i in handlers if (len(i) > 1)]
+        self.shortopts = ''.join([i + ':' * (i in self.takes_argument)
+            for i in handlers if len(i) == 1])
+        self.longopts = [i + '=' * (i in self.takes_argument)
+            for i in handlers if (len(i) > 1)]
 
     def handler(self, option):
-        i = 'handle_%s' % option.lstrip('-')
+        i = 'handle_%s' % option.lstrip('-').rstrip('=:')
         if hasattr(self, i):
             return getattr(self, i)
 
@@ -100,7 +397,7 @@ class Main():
         """ Shows this message """
         print sys.modules.get(__name__).__doc__
         descriptions = {}
-        for i in list(self.shortopts) + self.longopts:
+        for i in list(self.shortopts.replace(':', '')) + self.longopts:
             d = self.handler(i).__doc__
             if d in descriptions:
                 descriptions[d].append(i)
@@ -129,6 +426,30 @@ class Main():
         sys.exit(0)
     handle_t = handle_test
 
+    def handle_index(self, v):
+        """ The user index file (default ~/.secretaribot_users.db) """
+        options['index'] = v
+
+    def handle_journal(self, v):
+        """ The journal of what's been done
+        (default ~/.secretaribot_despam_journal) """
+        options['journal'] = v
+
+    def handle_ahead(self, v):
+        """ How many users to look up ahead of the one being asked about
+        (default 5) """
+        options['ahead'] = int(v)
+
+    def handle_deleters(self, v):
+        """ How many deletes to have going at once, without Special:Nuke
+        (default 4) """
+        options['deleters'] = int(v)
+
+    def handle_rate(self, v):
+        """ Most deletes to make a second, without Special:Nuke (default 2;
+        0 for no limit) """
+        options['rate'] = float(v)
+
     def run(self, main=None, argv=None):
         """ Execute main function, having stripped out options and called the
         responsible handler functions within the class. Main defaults to
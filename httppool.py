@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+##
+# httppool.py
+###
+"""httppool.py
+
+Keep-alive HTTP for scripts that hit the same hosts over and over. Keeps idle
+connections per host and reuses them, asks for gzip/deflate and unpacks it as
+it's read, and counts how many requests went over reused connections. Urls
+that aren't http or https are passed on to urllib2.
+
+Usage: httppool.py
+ Runs the tests, the same as with -t.
+
+"""
+
+__version__ = "0.1"
+__author__ = "Danny O'Brien <http://www.spesh.com/danny/>"
+__copyright__ = "Copyright Danny O'Brien"
+__contributors__ = None
+__license__ = "GPL v3"
+
+import httplib
+import urllib2
+import urlparse
+import socket
+import threading
+import zlib
+import gzip
+import StringIO
+import errno
+import time
+import BaseHTTPServer
+import SocketServer
+import unittest
+
+USER_AGENT = 'Secretaribot/%s' % __version__
+REDIRECTS = (301, 302, 303, 307)
+MAX_REDIRECTS = 5
+# Requests that can be sent again if a reused connection turns out to be dead
+RETRYABLE = ('GET', 'HEAD')
+# What a server closing an idle connection looks like when we next use it
+CLOSED = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+# Seconds a connection can have been idle and still be used for a request that
+# can't be sent again, before the server is likely to have closed it
+FRESH = 2.0
+
+
+class Response:
+    """ What Pool.open hands back. Looks enough like a urllib2 response for
+    the other scripts: .code, .url, .headers (a dict with lower-case keys),
+    .read([n]), .geturl() and .close(). Compressed bodies are unpacked as
+    they're read. The connection goes back to the pool once the body has been
+    read to the end; closing the response before that closes the
+    connection. """
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = dict(response.getheaders())
+        self.buffer = ''
+        self.decoder = None
+        if self.headers.get('content-encoding') in ('gzip', 'deflate'):
+            self.decoder = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        if response.length == 0:
+            self._finish(response.read())
+
+    def _finish(self, raw=''):
+        self.pool._count('bytes', len(raw))
+        if self.decoder:
+            raw = self.decoder.decompress(raw) + self.decoder.flush()
+            self.decoder = None
+        self.buffer += raw
+        if self.conn is not None:
+            self.pool._checkin(self.key, self.conn, self.response.will_close)
+            self.conn = None
+
+    def read(self, n=-1):
+        while self.conn is not None and (n < 0 or len(self.buffer) < n):
+            if n < 0:
+                raw = self.response.read()
+            else:
+                raw = self.response.read(max(n, 8192))
+            if not raw:
+                self._finish()
+                break
+            self.pool._count('bytes', len(raw))
+            if self.decoder:
+                raw = self.decoder.decompress(raw)
+            self.buffer += raw
+        if n < 0:
+            (data, self.buffer) = (self.buffer, '')
+        else:
+            (data, self.buffer) = (self.buffer[:n], self.buffer[n:])
+        return data
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.buffer = ''
+
+
+class Pool:
+    """ Persistent connections, kept per (scheme, host, port). Safe to share
+    between threads: each request has a connection to itself until its
+    response has been read. connect_timeout limits how long we wait to
+    connect, timeout how long any one read or write can take. Requests
+    that can't safely be sent twice only reuse connections that have been
+    idle for less than `fresh` seconds. """
+    def __init__(self, timeout=None, max_idle=8, connect_timeout=None,
+            fresh=FRESH):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_idle = max_idle
+        self.fresh = fresh
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections': 0, 'reused': 0,
+                'bytes': 0}
+
+    def _count(self, stat, n=1):
+        self.lock.acquire()
+        self.stats[stat] += n
+        self.lock.release()
+
+    def _checkout(self, key, fresh=None):
+        """ Returns (connection, reused). If fresh is given, connections
+        idle for longer than that aren't reused, but closed. """
+        self.lock.acquire()
+        try:
+            idle = self.idle.get(key, [])
+            while idle:
+                (conn, since) = idle.pop()
+                if fresh is None or time.time() - since < fresh:
+                    self.stats['reused'] += 1
+                    return (conn, True)
+                conn.close()
+            self.stats['connections'] += 1
+        finally:
+            self.lock.release()
+        return (self._connect(key), False)
+
+    def _connect(self, key):
+        (scheme, host, port) = key
+        timeout = self.connect_timeout or self.timeout
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        conn.connect()
+        conn.sock.settimeout(self.timeout)
+        return conn
+
+    def _checkin(self, key, conn, will_close=False):
+        self.lock.acquire()
+        try:
+            idle = self.idle.setdefault(key, [])
+            if will_close or len(idle) >= self.max_idle:
+                conn.close()
+            else:
+                idle.append((conn, time.time()))
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for conns in self.idle.values():
+                for (conn, since) in conns:
+                    conn.close()
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+    def _request(self, key, method, path, headers, body):
+        """ Sends one request. If it went over a reused connection that the
+        server had closed in the meantime (it was reset, or closed without
+        any reply), a GET or HEAD is sent again on a fresh connection.
+        Nothing is sent again after a timeout, and nothing else is sent again
+        at all: a POST may have been acted on already. """
+        if method in RETRYABLE:
+            (conn, reused) = self._checkout(key)
+        else:
+            (conn, reused) = self._checkout(key, self.fresh)
+        try:
+            conn.request(method, path, body, headers)
+            return (conn, conn.getresponse())
+        except (httplib.HTTPException, socket.error), e:
+            conn.close()
+            if not (reused and method in RETRYABLE and closed_early(e)):
+                raise
+        self._count('connections')
+        conn = self._connect(key)
+        conn.request(method, path, body, headers)
+        return (conn, conn.getresponse())
+
+    def open(self, url, method='GET', headers={}, body=None):
+        """ Makes a request and returns a Response. A 304 comes back as a
+        response; other 4xx and 5xx statuses raise urllib2.HTTPError, like
+        urllib2 does. Redirects are followed. """
+        for i in range(MAX_REDIRECTS + 1):
+            (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+            if scheme not in ('http', 'https'):
+                return urllib2.urlopen(url, timeout=self.timeout)
+            host = netloc.rsplit('@', 1)[-1]
+            port = None
+            if ':' in host and not host.endswith(']'):
+                (host, port) = host.rsplit(':', 1)
+                port = int(port)
+            key = (scheme, host, port or (scheme == 'https' and 443 or 80))
+            h = {'Accept-Encoding': 'gzip, deflate', 'User-Agent': USER_AGENT}
+            h.update(headers)
+            self._count('requests')
+            (conn, response) = self._request(key, method,
+                    (path or '/') + (query and '?' + query or ''), h, body)
+            f = Response(self, key, conn, response, url)
+            if f.code in REDIRECTS and 'location' in f.headers:
+                f.close()
+                url = urlparse.urljoin(url, f.headers['location'])
+                if f.code == 303:
+                    (method, body) = ('GET', None)
+                continue
+            if f.code >= 400:
+                f.close()
+                raise urllib2.HTTPError(url, f.code, f.msg, f.headers, None)
+            return f
+        raise urllib2.HTTPError(url, f.code, "Too many redirects", f.headers,
+                None)
+
+    def report(self):
+        return ("%(requests)d requests over %(connections)d connections "
+                "(%(reused)d reused), %(bytes)d bytes received" % self.stats)
+
+
+def closed_early(e):
+    """ Whether e means the server closed the connection before replying,
+    rather than (say) taking too long to. """
+    if isinstance(e, httplib.BadStatusLine):
+        return True
+    return (isinstance(e, socket.error) and
+            not isinstance(e, socket.timeout) and
+            getattr(e, 'errno', None) in CLOSED)
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Keep-alive server for the tests: /gzip sends a gzipped body, /drop
+    quietly closes the connection after answering, /slow waits a second
+    before answering, and anything else gets a plain body. `seen` counts the
+    requests for each path. """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = 'Hello ' * 100
+    seen = {}
+
+    def do_GET(self):
+        body = self.body
+        self.seen[self.path] = self.seen.get(self.path, 0) + 1
+        if self.path == '/slow':
+            time.sleep(1)
+        if self.path == '/drop':
+            self.close_connection = 1
+        self.send_response(200)
+        if self.path == '/gzip':
+            s = StringIO.StringIO()
+            g = gzip.GzipFile(fileobj=s, mode='wb')
+            g.write(body)
+            g.close()
+            body = s.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.send_header('ETag', '"stub"')
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def stub_server(handler=StubHandler):
+    """ Starts a local server in a background thread; returns it and its
+    base url. """
+    server = StubServer(('127.0.0.1', 0), handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    return (server, 'http://127.0.0.1:%d' % server.server_address[1])
+
+
+class PoolReusesConnections(unittest.TestCase):
+    def setUp(self):
+        (self.server, self.base) = stub_server()
+        self.pool = Pool(timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_readsPlainBodies(self):
+        self.assertEqual(self.pool.open(self.base + '/').read(),
+                StubHandler.body)
+
+    def test_unpacksGzip(self):
+        f = self.pool.open(self.base + '/gzip')
+        self.assertEqual(f.headers['content-encoding'], 'gzip')
+        self.assertEqual(f.read(5) + f.read(), StubHandler.body)
+
+    def test_reusesConnectionsOnceBodiesAreRead(self):
+        for i in range(3):
+            self.pool.open(self.base + '/').read()
+        self.pool.open(self.base + '/', 'HEAD')
+        self.assertEqual(self.pool.stats['requests'], 4)
+        self.assertEqual(self.pool.stats['connections'], 1)
+        self.assertEqual(self.pool.stats['reused'], 3)
+
+    def test_unreadResponsesDontShareConnections(self):
+        f = self.pool.open(self.base + '/')
+        self.pool.open(self.base + '/').read()
+        f.close()
+        self.assertEqual(self.pool.stats['connections'], 2)
+
+    def test_getsAreResentWhenTheServerDroppedTheConnection(self):
+        self.pool.open(self.base + '/drop').read()
+        time.sleep(0.1)
+        self.assertEqual(self.pool.open(self.base + '/').read(),
+                StubHandler.body)
+        self.assertEqual(self.pool.stats['connections'], 2)
+
+    def test_postsAreNeverResent(self):
+        self.pool.open(self.base + '/drop').read()
+        time.sleep(0.1)
+        self.assertRaises((httplib.HTTPException, socket.error),
+                self.pool.open, self.base + '/', 'POST', {}, 'a=b')
+
+    def test_postsDontUseConnectionsIdleForLong(self):
+        self.pool.fresh = 0.05
+        self.pool.open(self.base + '/drop').read()
+        time.sleep(0.1)
+        self.assertEqual(self.pool.open(self.base + '/', 'POST', {},
+            'a=b').read(), StubHandler.body)
+        self.assertEqual(self.pool.stats['reused'], 0)
+
+    def test_timeoutsAreNotResent(self):
+        StubHandler.seen.clear()
+        self.pool.timeout = 0.3
+        self.pool.open(self.base + '/').read()
+        self.assertRaises(socket.timeout, self.pool.open, self.base + '/slow')
+        time.sleep(1.5)
+        self.assertEqual(StubHandler.seen['/slow'], 1)
+
+    def test_headHasEtag(self):
+        f = self.pool.open(self.base + '/', 'HEAD')
+        self.assertEqual(f.headers['etag'], '"stub"')
+        self.assertEqual(f.read(), '')
+
+
+def main(args):
+    """ There's nothing here to run on its own, so runs the tests. """
+    Main().handle_test(None)
+
+import sys
+import getopt
+
+
+class Main():
+    """ Encapsulates option handling. Subclass to add new options,
+        add 'handle_x' method for an -x option,
+        add 'handle_xlong' method for an --xlong option
+        help (-h, --help) should be automatically created from module
+        docstring and handler docstrings.
+        test (-t, --test) will run all docstring and unittests it finds
+        """
+    class Usage(Exception):
+        """ Use this to generate a Usage message """
+        def __init__(self, msg):
+            self.msg = msg
+
+    def __init__(self):
+        handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
+        self.shortopts = ''.join([i for i in handlers if len(i) == 1])
+        self.longopts = [i for i in handlers if (len(i) > 1)]
+
+    def handler(self, option):
+        i = 'handle_%s' % option.lstrip('-')
+        if hasattr(self, i):
+            return getattr(self, i)
+
+    def default_main(self, args):
+        print sys.argv[0], " called with ", args
+
+    def handle_help(self, v):
+        """ Shows this message """
+        print sys.modules.get(__name__).__doc__
+        descriptions = {}
+        for i in list(self.shortopts) + self.longopts:
+            d = self.handler(i).__doc__
+            if d in descriptions:
+                descriptions[d].append(i)
+            else:
+                descriptions[d] = [i]
+        for d, opts in descriptions.iteritems():
+            for i in opts:
+                if len(i) == 1:
+                    print '-%s' % i,
+                else:
+                    print '--%s' % i,
+            print
+            print d
+        sys.exit(0)
+    handle_h = handle_help
+
+    def handle_test(self, v):
+        """ Runs test suite for file """
+        import doctest
+        import unittest
+        suite = unittest.defaultTestLoader.loadTestsFromModule(
+                sys.modules.get(__name__))
+        suite.addTest(doctest.DocTestSuite())
+        runner = unittest.TextTestRunner()
+        runner.run(suite)
+        sys.exit(0)
+    handle_t = handle_test
+
+    def run(self, main=None, argv=None):
+        """ Execute main function, having stripped out options and called the
+        responsible handler functions within the class. Main defaults to
+        listing the remaining arguments.
+        """
+        if not callable(main):
+            main = self.default_main
+        if argv is None:
+            argv = sys.argv
+        try:
+            try:
+                opts, args = getopt.getopt(argv[1:],
+                        self.shortopts, self.longopts)
+            except getopt.error, msg:
+                raise self.Usage(msg)
+            for o, a in opts:
+                (self.handler(o))(a)
+            return main(args)
+        except self.Usage, err:
+            print >>sys.stderr, err.msg
+            self.handle_help(None)
+            return 2
+
+if __name__ == "__main__":
+    sys.exit(Main().run(main) or 0)
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+##
+# journal.py
+###
+"""journal.py
+
+Crash-safe record of what the despamming scripts have planned and done: one
+JSON object a line, only ever appended to, flushed as it's written and
+synced to disk every so many entries. A script that's restarted reads it back
+and skips whatever's already done. compact() rewrites it with just the
+latest entry for each action, and swaps the new file in under anyone else
+who has the old one open, so each script keeps a journal of its own.
+
+Usage: journal.py [--compact] file
+ Says how many actions in the journal are done, failed, and still to do.
+
+"""
+
+__version__ = "0.1"
+__author__ = "Danny O'Brien <http://www.spesh.com/danny/>"
+__copyright__ = "Copyright Danny O'Brien"
+__contributors__ = None
+__license__ = "GPL v3"
+
+import os
+import json
+import time
+import threading
+import tempfile
+import shutil
+import unittest
+
+SYNC_EVERY = 50
+SYNC_INTERVAL = 5.0
+
+
+class Journal:
+    """ Keeps the latest status ('planned', 'done' or 'failed') of each
+    (user, action, target) in memory, along with which of them belong to
+    each user, and appends every change to the file.
+    Entries are synced to disk every sync_every entries, or sync_interval
+    seconds, whichever comes first, and on sync() and close(). """
+    def __init__(self, path, sync_every=SYNC_EVERY,
+            sync_interval=SYNC_INTERVAL):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.state = {}
+        self.by_user = {}
+        self.lock = threading.Lock()
+        line = ''
+        if os.path.exists(path):
+            for line in open(path):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line, if we crashed half way through it
+                    continue
+                self.remember(entry)
+        self.f = open(path, 'a')
+        if line and not line.endswith('\n'):
+            # so the next entry doesn't get tacked on to a half-written one
+            self.f.write('\n')
+        self.unsynced = 0
+        self.synced = time.time()
+
+    def key(self, entry):
+        return (entry['user'], entry['action'], entry.get('target', ''))
+
+    def remember(self, entry):
+        key = self.key(entry)
+        self.state[key] = entry
+        self.by_user.setdefault(key[0], set()).add(key)
+
+    def write(self, user, action, target, status, **details):
+        entry = dict(details, user=user, action=action, status=status,
+                time=time.time())
+        if target:
+            entry['target'] = target
+        self.lock.acquire()
+        try:
+            self.remember(entry)
+            self.f.write(json.dumps(entry, sort_keys=True) + '\n')
+            self.f.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every or \
+                    time.time() - self.synced >= self.sync_interval:
+                self._sync()
+        finally:
+            self.lock.release()
+
+    def _sync(self):
+        os.fsync(self.f.fileno())
+        self.unsynced = 0
+        self.synced = time.time()
+
+    def sync(self):
+        self.lock.acquire()
+        try:
+            self._sync()
+        finally:
+            self.lock.release()
+
+    def plan(self, user, action, target=''):
+        self.write(user, action, target, 'planned')
+
+    def done(self, user, action, target='', **details):
+        self.write(user, action, target, 'done', **details)
+
+    def failed(self, user, action, target='', **details):
+        self.write(user, action, target, 'failed', **details)
+
+    def status(self, user, action, target=''):
+        entry = self.state.get((user, action, target))
+        return entry and entry['status']
+
+    def is_done(self, user, action, target=''):
+        return self.status(user, action, target) == 'done'
+
+    def started(self, user, actions=None):
+        """ Whether anything's been planned for user: any of actions, if
+        given. """
+        if actions is None:
+            return user in self.by_user
+        return [key for key in self.by_user.get(user, ())
+                if key[1] in actions] != []
+
+    def pending(self, user, action):
+        """ Targets of user's action that have been planned, but aren't done
+        yet. """
+        return sorted([key[2] for key in self.by_user.get(user, ())
+            if key[1] == action and self.state[key]['status'] != 'done'])
+
+    def once(self, user, action, func, target='', finished=None):
+        """ Runs func() unless the journal says it's been done already,
+        noting that it's planned, then done or failed. If it raises an
+        exception that finished(exception) says means it had already been
+        done (a page that's already deleted, say), that counts as done. """
+        if self.is_done(user, action, target):
+            return None
+        self.plan(user, action, target)
+        try:
+            result = func()
+        except Exception, e:
+            if finished and finished(e):
+                self.done(user, action, target, already=True)
+                return None
+            self.failed(user, action, target, error=str(e))
+            raise
+        self.done(user, action, target)
+        return result
+
+    def counts(self):
+        counts = {'planned': 0, 'done': 0, 'failed': 0}
+        for entry in self.state.values():
+            counts[entry['status']] += 1
+        return counts
+
+    def compact(self):
+        """ Rewrites the journal with just the latest entry for each action,
+        and swaps it in place of the old one. """
+        self.lock.acquire()
+        try:
+            (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(
+                os.path.abspath(self.path)))
+            f = os.fdopen(fd, 'w')
+            for entry in sorted(self.state.values(),
+                    key=lambda e: e['time']):
+                f.write(json.dumps(entry, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            self.f.close()
+            os.rename(tmp, self.path)
+            self.f = open(self.path, 'a')
+            self.unsynced = 0
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.sync()
+        self.f.close()
+
+
+class JournalRemembers(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_remembersWhatWasDone(self):
+        j = Journal(self.path)
+        j.plan('Spammer', 'block')
+        j.plan('Spammer', 'delete', 'Spam page')
+        j.done('Spammer', 'delete', 'Spam page')
+        j.close()
+        j = Journal(self.path)
+        self.assertTrue(j.is_done('Spammer', 'delete', 'Spam page'))
+        self.assertEqual(j.status('Spammer', 'block'), 'planned')
+        self.assertTrue(j.started('Spammer'))
+        self.assertTrue(j.started('Spammer', ['block']))
+        self.assertFalse(j.started('Spammer', ['merge']))
+        self.assertFalse(j.started('Someone'))
+
+    def test_knowsWhatIsStillToDo(self):
+        j = Journal(self.path)
+        j.plan('Spammer', 'delete', 'Spam page')
+        j.plan('Spammer', 'delete', 'More spam')
+        j.failed('Spammer', 'delete', 'Yet more spam')
+        j.done('Spammer', 'delete', 'More spam')
+        j.plan('Spammer', 'block')
+        self.assertEqual(j.pending('Spammer', 'delete'),
+                ['Spam page', 'Yet more spam'])
+        self.assertEqual(j.pending('Someone', 'delete'), [])
+
+    def test_survivesAHalfWrittenLine(self):
+        j = Journal(self.path)
+        j.done('Spammer', 'merge')
+        j.close()
+        open(self.path, 'a').write('{"action": "bl')
+        j = Journal(self.path)
+        self.assertTrue(j.is_done('Spammer', 'merge'))
+        j.done('Someone', 'merge')
+        j.close()
+        j = Journal(self.path)
+        self.assertTrue(j.is_done('Someone', 'merge'))
+
+    def test_onceOnlyRunsOnce(self):
+        j = Journal(self.path)
+        calls = []
+        j.once('Spammer', 'block', lambda: calls.append(1))
+        j.once('Spammer', 'block', lambda: calls.append(1))
+        self.assertEqual(calls, [1])
+
+    def test_onceNotesFailures(self):
+        j = Journal(self.path)
+
+        def fail():
+            raise ValueError('nope')
+        self.assertRaises(ValueError, j.once, 'Spammer', 'block', fail)
+        self.assertEqual(j.status('Spammer', 'block'), 'failed')
+        j.once('Spammer', 'block', fail, finished=lambda e: True)
+        self.assertTrue(j.is_done('Spammer', 'block'))
+
+    def test_syncsInBatches(self):
+        j = Journal(self.path, sync_every=3, sync_interval=60)
+        j.plan('A', 'merge')
+        j.plan('B', 'merge')
+        self.assertEqual(j.unsynced, 2)
+        j.plan('C', 'merge')
+        self.assertEqual(j.unsynced, 0)
+
+    def test_compactKeepsTheLatestEntries(self):
+        j = Journal(self.path)
+        for i in range(5):
+            j.plan('Spammer', 'merge')
+            j.failed('Spammer', 'merge')
+        j.done('Spammer', 'merge')
+        j.compact()
+        j.plan('Other', 'merge')
+        j.close()
+        self.assertEqual(len(open(self.path).readlines()), 2)
+        j = Journal(self.path)
+        self.assertTrue(j.is_done('Spammer', 'merge'))
+        self.assertEqual(j.counts(), {'planned': 1, 'done': 1, 'failed': 0})
+
+
+options = {'compact': False}
+
+
+def main(args):
+    if not args:
+        raise Main.Usage("Which journal? eg ~/.secretaribot_despam_journal")
+    j = Journal(args[0])
+    print "%(done)d done, %(failed)d failed, %(planned)d planned" % \
+            j.counts()
+    if options['compact']:
+        j.compact()
+    j.close()
+
+import sys
+import getopt
+
+
+class Main():
+    """ Encapsulates option handling. Subclass to add new options,
+        add 'handle_x' method for an -x option,
+        add 'handle_xlong' method for an --xlong option
+        help (-h, --help) should be automatically created from module
+        docstring and handler docstrings.
+        test (-t, --test) will run all docstring and unittests it finds
+        """
+    class Usage(Exception):
+        """ Use this to generate a Usage message """
+        def __init__(self, msg):
+            self.msg = msg
+
+    def __init__(self):
+        handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
+        self.shortopts = ''.join([i for i in handlers if len(i) == 1])
+        self.longopts = [i for i in handlers if (len(i) > 1)]
+
+    def handler(self, option):
+        i = 'handle_%s' % option.lstrip('-')
+        if hasattr(self, i):
+            return getattr(self, i)
+
+    def default_main(self, args):
+        print sys.argv[0], " called with ", args
+
+    def handle_help(self, v):
+        """ Shows this message """
+        print sys.modules.get(__name__).__doc__
+        descriptions = {}
+        for i in list(self.shortopts) + self.longopts:
+            d = self.handler(i).__doc__
+            if d in descriptions:
+                descriptions[d].append(i)
+            else:
+                descriptions[d] = [i]
+        for d, opts in descriptions.iteritems():
+            for i in opts:
+                if len(i) == 1:
+                    print '-%s' % i,
+                else:
+                    print '--%s' % i,
+            print
+            print d
+        sys.exit(0)
+    handle_h = handle_help
+
+    def handle_test(self, v):
+        """ Runs test suite for file """
+        import doctest
+        import unittest
+        suite = unittest.defaultTestLoader.loadTestsFromModule(
+                sys.modules.get(__name__))
+        suite.addTest(doctest.DocTestSuite())
+        runner = unittest.TextTestRunner()
+        runner.run(suite)
+        sys.exit(0)
+    handle_t = handle_test
+
+    def handle_compact(self, v):
+        """ Rewrite the journal with just the latest entry for each action """
+        options['compact'] = True
+
+    def run(self, main=None, argv=None):
+        """ Execute main function, having stripped out options and called the
+        responsible handler functions within the class. Main defaults to
+        listing the remaining arguments.
+        """
+        if not callable(main):
+            main = self.default_main
+        if argv is None:
+            argv = sys.argv
+        try:
+            try:
+                opts, args = getopt.getopt(argv[1:],
+                        self.shortopts, self.longopts)
+            except getopt.error, msg:
+                raise self.Usage(msg)
+            for o, a in opts:
+                (self.handler(o))(a)
+            return main(args)
+        except self.Usage, err:
+            print >>sys.stderr, err.msg
+            self.handle_help(None)
+            return 2
+
+if __name__ == "__main__":
+    sys.exit(Main().run(main) or 0)
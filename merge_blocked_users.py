@@ -8,6 +8,21 @@ Merge (and then delete) all blocked users into a single, uber-spam account.
 
 'And nothing of value was lost'
 
+Usage: merge_blocked_users.py [--index=file] [--journal=file] [--sharded]
+    [--api] [--workers=n] [--mergers=n] [--rate=merges/second] [username]
+ Users are kept in the local user index (see userindex.py), so each run only
+ downloads users created since the last one, and skips anyone already merged.
+ With --sharded, it goes through the whole user list instead, split up by
+ first letter, with several letters fetched at once. With --api, it goes
+ through the whole list through api.php instead, which says who's blocked
+ in the same requests.
+ Blocked users are merged by several workers at once, while the next users
+ are still being checked, but never faster than --rate. A progress line
+ shows how fast it's going, and how long the blocked users found so far
+ will take.
+ Each merge is noted in a journal (see journal.py) when it's queued and when
+ it's done, so a restarted run skips merges that are already done.
+
 """
 
 __version__ = "0.1"
@@ -16,12 +31,32 @@ __copyright__ = "Copyright Danny O'Brien"
 __contributors__ = None
 __license__ = "GPL v3"
 
+import itertools
+import time
+import os
+import unittest
+
 from pywikipediabot import wikipedia
 import userlistpage
+import userindex
 import userlib
+import wikisession
+import workpool
+import journal
+
+# What Special:UserMerge says (on top of MediaWiki's own messages) when the
+# token it was sent is no good
+MERGE_FAILURES = wikisession.SESSION_FAILURES + ('usermerge-badtoken',
+        'Invalid edit token')
+
+# Kept apart from death_to_wikispammers' journal: see journal.py
+JOURNAL = os.path.expanduser('~/.secretaribot_merge_journal')
 
+options = {'index': userindex.DEFAULT_INDEX, 'sharded': False, 'api': False,
+        'workers': 4, 'mergers': 4, 'rate': 1.0, 'journal': JOURNAL}
 
-def mergeUser(site, olduser, newuser, delete=False):
+
+def mergeUser(site, olduser, newuser, delete=False, actions=None):
     predata = {}
     predata['olduser'] = olduser.username
     predata['newuser'] = newuser.username
@@ -31,9 +66,10 @@ def mergeUser(site, olduser, newuser, delete=False):
         predata['deleteuser'] = "1"
     else:
         predata['deleteuser'] = "0"
-    predata['token'] = site.getToken(sysop=True)
 
-    (r, text) = site.postForm('/wiki/Special:UserMerge', predata, sysop=True)
+    actions = actions or wikisession.WikiActions(site)
+    text = actions.form('Special:UserMerge', predata,
+            failures=MERGE_FAILURES)
     if ('Merge from' in text) and ('is complete' in text):
         merge_succeed = True
     else:
@@ -45,6 +81,54 @@ def mergeUser(site, olduser, newuser, delete=False):
     return (merge_succeed, delete_succeed)
 
 
+class Progress:
+    """ Counts blocked users found, and merges done, and keeps a line at the
+    bottom of the output saying how fast it's going. """
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.start = time.time()
+        self.found = 0
+        self.done = 0
+        self.failed = 0
+        self.width = 0
+
+    def line(self, now=None):
+        elapsed = max((now or time.time()) - self.start, 0.001)
+        rate = self.done / elapsed
+        if rate:
+            eta = int((self.found - self.done) / rate)
+            eta = '%d:%02d:%02d' % (eta / 3600, eta / 60 % 60, eta % 60)
+        else:
+            eta = '?'
+        return '%d/%d merged, %d failed, %.2f/s, ETA %s' % (
+                self.done - self.failed, self.found, self.failed, rate, eta)
+
+    def show(self):
+        line = self.line()
+        self.out.write('\r' + line.ljust(self.width))
+        self.out.flush()
+        self.width = len(line)
+
+    def note(self, message):
+        """ Prints message above the progress line. """
+        self.out.write('\r' + message.ljust(self.width) + '\n')
+        self.width = 0
+        self.show()
+
+
+class ProgressLine(unittest.TestCase):
+    def test_showsRateAndEta(self):
+        p = Progress()
+        (p.found, p.done, p.failed) = (100, 10, 1)
+        self.assertEqual(p.line(p.start + 5),
+                '9/100 merged, 1 failed, 2.00/s, ETA 0:00:45')
+
+    def test_noEtaBeforeAnythingIsDone(self):
+        p = Progress()
+        p.found = 3
+        self.assert_(p.line().endswith('ETA ?'))
+
+
 def main(args):
     if not args:
         initial_user = "SpammerHellDontDelete"
@@ -52,16 +136,67 @@ def main(args):
         initial_user = args[0]
 
     nb = wikipedia.Site('en', "noisebridge")
+    session = wikisession.shared(nb, sysop=True)
+    actions = wikisession.WikiActions(nb, session=session)
     spam_user = userlib.User(nb, "SpammerHellDontDelete")
+    index = userindex.UserIndex(options['index'])
+    done = journal.Journal(options['journal'])
+    if args:
+        index.set_cursor(initial_user)
 
-    ul = userlistpage.user_list_since_user(nb, initial_user).getUsers()
-    for i in ul:
-        print i
-        if i.isBlocked():
-            print "Merging", i
-            (merged, deleted) = mergeUser(nb, i, spam_user, delete=True)
-            print "Merged:", merged
-            print "Deleted:", deleted
+    if options['api']:
+        new_users = userindex.index_users(index,
+                userlistpage.iter_api_users(nb))
+    elif options['sharded']:
+        new_users = userindex.index_users(index,
+                userlistpage.iter_users_sharded(nb,
+                    workers=options['workers']))
+    else:
+        new_users = userindex.sync_users(nb, index, initial_user)
+    ul = userlistpage.with_block_status(nb, itertools.chain(
+        index.records(nb), new_users))
+    limiter = workpool.RateLimiter(options['rate'])
+    progress = Progress()
+
+    def blocked(users):
+        for i in users:
+            if i.isBlocked():
+                index.set_blocked(i.name())
+                if done.is_done(i.name(), 'merge'):
+                    continue
+                done.plan(i.name(), 'merge')
+                progress.found += 1
+                yield i
+
+    def merge(i):
+        limiter.wait()
+        return mergeUser(nb, i, spam_user, delete=True, actions=actions)
+
+    for (i, result, error) in workpool.imap_unordered(merge, blocked(ul),
+            workers=options['mergers']):
+        progress.done += 1
+        if error:
+            progress.failed += 1
+            done.failed(i.name(), 'merge', error=str(error))
+            progress.note("Couldn't merge %s: %s" % (i, error))
+            continue
+        (merged, deleted) = result
+        if merged:
+            done.done(i.name(), 'merge', deleted=deleted)
+        else:
+            progress.failed += 1
+            done.failed(i.name(), 'merge')
+        progress.note("%s merged: %s deleted: %s" % (i, merged, deleted))
+        if merged:
+            index.mark(i.name(), 'merged')
+        if deleted:
+            index.mark(i.name(), 'deleted')
+        index.commit()
+    print
+    index.close()
+    done.compact()
+    done.close()
+    print session.report()
 
 
 import sys
@@ -75,7 +210,10 @@ class Main():
         help (-h, --help) should be automatically created from module
         docstring and handler docstrings.
         test (-t, --test) will run all docstring and unittests it finds
+        options listed in takes_argument expect a value (--x=value)
         """
+    takes_argument = ['index', 'journal', 'workers', 'mergers', 'rate']
+
     class Usage(Exception):
         """ Use this to generate a Usage message """
         def __init__(self, msg):
@@ -83,11 +221,13 @@ class Main():
 
     def __init__(self):
         handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
-        self.shortopts = ''.join([i for i in handlers if len(i) == 1])
-        self.longopts = [i for i in handlers if (len(i) > 1)]
+        self.shortopts = ''.join([i + ':' * (i in self.takes_argument)
+            for i in handlers if len(i) == 1])
+        self.longopts = [i + '=' * (i in self.takes_argument)
+            for i in handlers if (len(i) > 1)]
 
     def handler(self, option):
-        i = 'handle_%s' % option.lstrip('-')
+        i = 'handle_%s' % option.lstrip('-').rstrip('=:')
         if hasattr(self, i):
             return getattr(self, i)
 
@@ -98,7 +238,7 @@ class Main():
         """ Shows this message """
         print sys.modules.get(__name__).__doc__
         descriptions = {}
-        for i in list(self.shortopts) + self.longopts:
+        for i in list(self.shortopts.replace(':', '')) + self.longopts:
             d = self.handler(i).__doc__
             if d in descriptions:
                 descriptions[d].append(i)
@@ -127,6 +267,36 @@ class Main():
         sys.exit(0)
     handle_t = handle_test
 
+    def handle_index(self, v):
+        """ The user index file (default ~/.secretaribot_users.db) """
+        options['index'] = v
+
+    def handle_journal(self, v):
+        """ The journal of what's been done
+        (default ~/.secretaribot_merge_journal) """
+        options['journal'] = v
+
+    def handle_sharded(self, v):
+        """ Go through the whole user list, a range of names at a time """
+        options['sharded'] = True
+
+    def handle_api(self, v):
+        """ Go through the whole user list through api.php, which says who's
+        blocked as it goes """
+        options['api'] = True
+
+    def handle_workers(self, v):
+        """ How many ranges to fetch at once with --sharded (default 4) """
+        options['workers'] = int(v)
+
+    def handle_mergers(self, v):
+        """ How many merges to have going at once (default 4) """
+        options['mergers'] = int(v)
+
+    def handle_rate(self, v):
+        """ Most merges to make a second (default 1; 0 for no limit) """
+        options['rate'] = float(v)
+
     def run(self, main=None, argv=None):
         """ Execute main function, having stripped out options and called the
         responsible handler functions within the class. Main defaults to
@@ -20,6 +20,7 @@ __license__ = "GPL v3"
 from pywikipediabot import wikipedia
 from datetime import date, timedelta
 import re
+import wikisession
 
 
 def ordinal(value):
@@ -79,7 +80,7 @@ def next_ordinal(site, last_page):
     else:
         return "XXXth"
 
-def create_new_notes(site, last_page, next_page):
+def create_new_notes(site, last_page, next_page, actions):
     template = wikipedia.Page(site, "Meeting_Notes_Template").get()
     template = re.sub("XXXth Meeting of Noisebridge",
             next_ordinal(site, last_page) + " Meeting of Noisebridge",
@@ -88,20 +89,22 @@ def create_new_notes(site, last_page, next_page):
     if future_page.exists():
         print "Already a page at " + next_page + " . Not overwriting."
     else:
-        future_page.put(template, u"Secretaribot says its time for the "
-                + next_ordinal(site, last_page) + " Noisebridge notes")
+        actions.edit(next_page, template, u"Secretaribot says its time for "
+                "the " + next_ordinal(site, last_page) + " Noisebridge notes")
 
-def redirect_pages(site, last_page, next_page):
+def redirect_pages(site, last_page, next_page, actions):
     lm = wikipedia.Page(site, "last_meeting")
     nm = wikipedia.Page(site, "next_meeting")
     if lm.getRedirectTarget().title() != last_page:
         print "Redirecting [[Last_meeting]] to ", last_page
-        lm.put("#REDIRECT [[%s]]" % last_page, "Secretaribot updating next meeting page")
+        actions.edit(lm.title(), "#REDIRECT [[%s]]" % last_page,
+                "Secretaribot updating next meeting page")
     else:
         print "Last_meeting already points to correct page."
     if nm.getRedirectTarget().title() != next_page:
         print "Redirecting [[Next_meeting]] to ", next_page
-        nm.put("#REDIRECT [[%s]]" % next_page, "Secretaribot updating for next meeting page")
+        actions.edit(nm.title(), "#REDIRECT [[%s]]" % next_page,
+                "Secretaribot updating for next meeting page")
     else:
         print "Next_meeting already points to correct page."
 
@@ -109,8 +112,9 @@ def main(args):
     site = wikipedia.Site("en")
     last_page = "Meeting Notes " + str(past_tuesday()).replace("-", " ")
     next_page = "Meeting Notes " + str(future_tuesday()).replace("-", " ")
-    create_new_notes(site, last_page, next_page)
-    redirect_pages(site, last_page, next_page)
+    actions = wikisession.WikiActions(site, sysop=False)
+    create_new_notes(site, last_page, next_page, actions)
+    redirect_pages(site, last_page, next_page, actions)
 
 import sys
 import getopt
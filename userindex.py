@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+##
+# userindex.py
+###
+"""userindex.py
+
+Local SQLite index of the wiki's users, in the order they were created, with
+what we know about each: whether they had a user page, whether they're
+blocked, and whether we've reviewed, merged or deleted them. It also keeps
+a cursor, the last user we've synced, so each run only asks the wiki for
+accounts created since then, and does its filtering locally.
+
+Usage: userindex.py [--index=file]
+ Shows how many users are in the index, and where the cursor is.
+
+"""
+
+__version__ = "0.1"
+__author__ = "Danny O'Brien <http://www.spesh.com/danny/>"
+__copyright__ = "Copyright Danny O'Brien"
+__contributors__ = None
+__license__ = "GPL v3"
+
+import sqlite3
+import time
+import os
+import unittest
+
+import userlistpage
+
+DEFAULT_INDEX = os.path.expanduser('~/.secretaribot_users.db')
+CURSOR = 'listusers'
+COMMIT_EVERY = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    seq INTEGER PRIMARY KEY,
+    name TEXT UNIQUE,
+    user_page INTEGER,
+    blocked INTEGER,
+    reviewed REAL,
+    merged REAL,
+    deleted REAL,
+    seen REAL);
+CREATE TABLE IF NOT EXISTS cursors (
+    name TEXT PRIMARY KEY,
+    username TEXT);
+'''
+
+FLAGS = ('reviewed', 'merged', 'deleted')
+
+
+def _bool(v):
+    if v is None:
+        return None
+    return bool(v)
+
+
+class UserIndex:
+    """ Wraps the SQLite file. Nothing is written to disk until commit(). """
+    def __init__(self, path=DEFAULT_INDEX):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def get(self, name):
+        """ What we know about the user called name, as a dict, or None. """
+        r = self.db.execute('SELECT * FROM users WHERE name = ?',
+                (name,)).fetchone()
+        if r is None:
+            return None
+        return dict(zip(r.keys(), r))
+
+    def add(self, user, now=None):
+        """ Notes a user from one of the lists, after any we already have.
+        Returns whether they were new to us; if they weren't, any hints the
+        user has about their user page or block are kept. """
+        blocked = getattr(user, 'blocked', None)
+        page = getattr(user, 'user_page_exists', None)
+        if self.get(user.name()) is not None:
+            if blocked is not None:
+                self.set_blocked(user.name(), blocked)
+            if page is not None:
+                self.db.execute('UPDATE users SET user_page = ? '
+                        'WHERE name = ?', (page, user.name()))
+            return False
+        self.db.execute('INSERT INTO users (name, user_page, blocked, seen) '
+                'VALUES (?, ?, ?, ?)', (user.name(), page, blocked,
+                    now or time.time()))
+        return True
+
+    def set_blocked(self, name, blocked=True):
+        self.db.execute('UPDATE users SET blocked = ? WHERE name = ?',
+                (blocked, name))
+
+    def mark(self, name, flag, now=None):
+        """ Notes that the user has been reviewed, merged or deleted. """
+        if flag not in FLAGS:
+            raise ValueError(flag)
+        self.db.execute('UPDATE users SET %s = ? WHERE name = ?' % flag,
+                (now or time.time(), name))
+
+    def cursor(self, name=CURSOR):
+        r = self.db.execute('SELECT username FROM cursors WHERE name = ?',
+                (name,)).fetchone()
+        return r and r[0]
+
+    def set_cursor(self, username, name=CURSOR):
+        self.db.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)',
+                (name, username))
+
+    def records(self, site, without=()):
+        """ UserRecords for everyone we know about, oldest first, leaving out
+        those who have been merged or deleted, or have been through any of
+        the flags in `without`. Blocks we know about are passed on as hints;
+        anyone not known to be blocked is left to be checked again. """
+        flags = ('merged', 'deleted') + tuple(without)
+        for f in flags:
+            if f not in FLAGS:
+                raise ValueError(f)
+        where = ' AND '.join(['%s IS NULL' % f for f in flags])
+        records = []
+        for r in self.db.execute('SELECT name, user_page, blocked FROM users '
+                'WHERE %s ORDER BY seq' % where).fetchall():
+            u = userlistpage.UserRecord(site, r['name'])
+            if r['user_page'] is not None:
+                u.forceUserPage(_bool(r['user_page']))
+            if r['blocked']:
+                u.forceBlocked(True)
+            records.append(u)
+        return records
+
+    def counts(self):
+        r = self.db.execute('SELECT COUNT(*), COUNT(NULLIF(blocked, 0)), '
+                'COUNT(reviewed), COUNT(merged), COUNT(deleted) '
+                'FROM users').fetchone()
+        return dict(zip(('users', 'blocked', 'reviewed', 'merged',
+            'deleted'), r))
+
+
+def sync_users(site, index, start, users=None):
+    """ Fetches accounts created since the index's cursor (or since start,
+    if the index hasn't been synced yet), adds them to the index, and yields
+    the ones that are new to it. users is the list to read from; by default,
+    Special:ListUsers from the cursor on. """
+    cursor = index.cursor() or start
+    if users is None:
+        users = userlistpage.iter_users_since_user(site, cursor)
+    return index_users(index, users, move_cursor=True)
+
+
+def index_users(index, users, move_cursor=False):
+    """ Adds users to the index as they go past, and yields the ones that
+    are new to it. Only lists in creation order should move the cursor. """
+    n = 0
+    for user in users:
+        new = index.add(user)
+        if move_cursor:
+            index.set_cursor(user.name())
+        n += 1
+        if n % COMMIT_EVERY == 0:
+            index.commit()
+        if new:
+            yield user
+    index.commit()
+
+
+class UserIndexRecords(unittest.TestCase):
+    def setUp(self):
+        self.index = UserIndex(':memory:')
+
+    def user(self, name, page=None, blocked=None):
+        u = userlistpage.UserRecord(None, name)
+        if page is not None:
+            u.forceUserPage(page)
+        if blocked is not None:
+            u.forceBlocked(blocked)
+        return u
+
+    def test_addsUsersOnce(self):
+        self.assertTrue(self.index.add(self.user('Alice', page=False)))
+        self.assertFalse(self.index.add(self.user('Alice', blocked=True)))
+        self.assertEqual(self.index.get('Alice')['user_page'], 0)
+        self.assertEqual(self.index.get('Alice')['blocked'], 1)
+        self.assertEqual(self.index.get('Bob'), None)
+
+    def test_recordsComeBackInCreationOrder(self):
+        for name in ['Zed', 'Alice', 'Mallory']:
+            self.index.add(self.user(name))
+        self.assertEqual([u.name() for u in self.index.records(None)],
+                ['Zed', 'Alice', 'Mallory'])
+
+    def test_recordsLeaveOutFinishedUsers(self):
+        for name in ['Alice', 'Bob', 'Carol', 'Dave']:
+            self.index.add(self.user(name))
+        self.index.mark('Alice', 'merged')
+        self.index.mark('Bob', 'deleted')
+        self.index.mark('Carol', 'reviewed')
+        self.assertEqual([u.name() for u in self.index.records(None)],
+                ['Carol', 'Dave'])
+        self.assertEqual([u.name() for u in
+            self.index.records(None, without=['reviewed'])], ['Dave'])
+        self.assertRaises(ValueError, self.index.mark, 'Dave', 'eaten')
+
+    def test_onlyBlocksArePassedOn(self):
+        self.index.add(self.user('Alice', blocked=True))
+        self.index.add(self.user('Bob', blocked=False))
+        (alice, bob) = self.index.records(None)
+        self.assertEqual((alice.blocked, bob.blocked), (True, None))
+
+    def test_syncStartsFromTheCursor(self):
+        asked = []
+
+        def lister(start):
+            asked.append(start)
+            return [self.user(n) for n in [start, start + '1', start + '2']]
+        new = list(sync_users(None, self.index, 'Zephyr', lister('Zephyr')))
+        self.assertEqual(len(new), 3)
+        self.assertEqual(self.index.cursor(), 'Zephyr2')
+        new = list(sync_users(None, self.index, 'Zephyr',
+            lister(self.index.cursor())))
+        self.assertEqual([u.name() for u in new], ['Zephyr21', 'Zephyr22'])
+        self.assertEqual(self.index.counts()['users'], 5)
+
+    def test_otherListsLeaveTheCursorAlone(self):
+        self.index.set_cursor('Zephyr')
+        new = list(index_users(self.index, [self.user('Alice')]))
+        self.assertEqual(len(new), 1)
+        self.assertEqual(self.index.cursor(), 'Zephyr')
+
+
+options = {'index': DEFAULT_INDEX}
+
+
+def main(args):
+    index = UserIndex(options['index'])
+    print "%(users)d users, %(blocked)d blocked, %(reviewed)d reviewed, " \
+            "%(merged)d merged, %(deleted)d deleted" % index.counts()
+    print "Synced up to", index.cursor()
+    index.close()
+
+import sys
+import getopt
+
+
+class Main():
+    """ Encapsulates option handling. Subclass to add new options,
+        add 'handle_x' method for an -x option,
+        add 'handle_xlong' method for an --xlong option
+        help (-h, --help) should be automatically created from module
+        docstring and handler docstrings.
+        test (-t, --test) will run all docstring and unittests it finds
+        options listed in takes_argument expect a value (--x=value)
+        """
+    takes_argument = ['index']
+
+    class Usage(Exception):
+        """ Use this to generate a Usage message """
+        def __init__(self, msg):
+            self.msg = msg
+
+    def __init__(self):
+        handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
+        self.shortopts = ''.join([i + ':' * (i in self.takes_argument)
+            for i in handlers if len(i) == 1])
+        self.longopts = [i + '=' * (i in self.takes_argument)
+            for i in handlers if (len(i) > 1)]
+
+    def handler(self, option):
+        i = 'handle_%s' % option.lstrip('-').rstrip('=:')
+        if hasattr(self, i):
+            return getattr(self, i)
+
+    def default_main(self, args):
+        print sys.argv[0], " called with ", args
+
+    def handle_help(self, v):
+        """ Shows this message """
+        print sys.modules.get(__name__).__doc__
+        descriptions = {}
+        for i in list(self.shortopts.replace(':', '')) + self.longopts:
+            d = self.handler(i).__doc__
+            if d in descriptions:
+                descriptions[d].append(i)
+            else:
+                descriptions[d] = [i]
+        for d, opts in descriptions.iteritems():
+            for i in opts:
+                if len(i) == 1:
+                    print '-%s' % i,
+                else:
+                    print '--%s' % i,
+            print
+            print d
+        sys.exit(0)
+    handle_h = handle_help
+
+    def handle_test(self, v):
+        """ Runs test suite for file """
+        import doctest
+        import unittest
+        suite = unittest.defaultTestLoader.loadTestsFromModule(
+                sys.modules.get(__name__))
+        suite.addTest(doctest.DocTestSuite())
+        runner = unittest.TextTestRunner()
+        runner.run(suite)
+        sys.exit(0)
+    handle_t = handle_test
+
+    def handle_index(self, v):
+        """ The index file (default ~/.secretaribot_users.db) """
+        options['index'] = v
+
+    def run(self, main=None, argv=None):
+        """ Execute main function, having stripped out options and called the
+        responsible handler functions within the class. Main defaults to
+        listing the remaining arguments.
+        """
+        if not callable(main):
+            main = self.default_main
+        if argv is None:
+            argv = sys.argv
+        try:
+            try:
+                opts, args = getopt.getopt(argv[1:],
+                        self.shortopts, self.longopts)
+            except getopt.error, msg:
+                raise self.Usage(msg)
+            for o, a in opts:
+                (self.handler(o))(a)
+            return main(args)
+        except self.Usage, err:
+            print >>sys.stderr, err.msg
+            self.handle_help(None)
+            return 2
+
+if __name__ == "__main__":
+    sys.exit(Main().run(main) or 0)
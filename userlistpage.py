@@ -6,6 +6,10 @@
 
 Utilities for getting lists of users from mediawiki installs
 
+Users come either from scraping Special:ListUsers, which can list them in the
+order they were created, or from api.php's list=allusers, which is quicker
+and doesn't depend on the skin, but only lists them alphabetically.
+
 """
 
 __version__ = "0.1"
@@ -15,18 +19,31 @@ __contributors__ = None
 __license__ = "GPL v3"
 
 
-from lxml import html
-from lxml import cssselect
+from lxml import etree
 
 import unittest
 
 import mechanize
 
 import os
+import tempfile
+import shutil
+import json
+import urllib
+import BaseHTTPServer
 
 from pywikipediabot import wikipedia
 import userlib
 import urlparse
+import httppool
+import workpool
+import wikisession
+
+API_PROPS = 'editcount|registration|blockinfo'
+# Where iter_users_sharded splits the list by default: one shard per leading
+# capital, with digits and punctuation in with the As, and anything past Z
+# (including non-ASCII names) in with the Zs.
+SHARDS = [''] + [chr(c) for c in range(ord('B'), ord('Z') + 1)]
 
 
 def user_list_since_user(site, lastUser):
@@ -35,12 +52,175 @@ def user_list_since_user(site, lastUser):
             '&username=%s&creationSort=1&limit=2000' % lastUser)
 
 
+def list_users_url(site):
+    return urlparse.urljoin(site.siteinfo()['base'],
+            site.get_address("Special:ListUsers"))
+
+
+def iter_users_since_user(site, lastUser, limit=500, url=None):
+    """ Yields users created since lastUser, as they're parsed, fetching
+    `limit` at a time and following the list's "next" links until there
+    aren't any more. """
+    query = {'username': lastUser, 'creationSort': 1, 'limit': limit}
+    if isinstance(lastUser, unicode):
+        query['username'] = lastUser.encode('utf-8')
+    return iter_users_from_url(site, (url or list_users_url(site)) + "?" +
+            urllib.urlencode(query))
+
+
+def iter_users_in_range(site, first, last=None, limit=500, url=None):
+    """ Yields users alphabetically, from first up to but not including last
+    (or to the end, if last is None). """
+    query = {'username': first, 'limit': limit}
+    if isinstance(first, unicode):
+        query['username'] = first.encode('utf-8')
+    users = iter_users_from_url(site, (url or list_users_url(site)) + "?" +
+            urllib.urlencode(query))
+    for user in users:
+        if last is not None and user.name() >= last:
+            return
+        yield user
+
+
+def iter_users_sharded(site, boundaries=SHARDS, workers=4, url=None,
+        lister=iter_users_in_range):
+    """ Lists every user alphabetically, by splitting the list into ranges at
+    boundaries and fetching up to `workers` ranges at once. Users come back in
+    order, each once: the first range's as they're parsed, and each later
+    range's as soon as the ranges before it are finished. Only a few pages'
+    worth of users are kept waiting for their turn. lister(site, first, last,
+    url=url) lists one range; anything it lists outside the range is
+    dropped. """
+    ranges = zip(boundaries, list(boundaries[1:]) + [None])
+
+    def shard((first, last)):
+        for user in lister(site, first, last, url=url):
+            if last is not None and user.name() >= last:
+                return
+            if user.name() >= first:
+                yield user
+    return workpool.chain_ordered(shard, ranges, workers=workers)
+
+
+def iter_users_from_url(site, url):
+    """ Yields the users on the list page at url, and the pages after it. """
+    while url:
+        page = user_list_from_url(site, url)
+        for user in page.iterUsers():
+            yield user
+        url = page.next_url
+
+
 def user_list_from_page(page, site, query):
     url = urlparse.urljoin(site.siteinfo()['base'], site.get_address(page))
-    f = url + "?" + query
-    browser = mechanize.Browser()
-    r = browser.open(f)
-    return UserListPage(site, r)
+    return user_list_from_url(site, url + "?" + query)
+
+
+def user_list_from_url(site, url):
+    return UserListPage(site, wikisession.shared().open(url))
+
+
+def api_query(url, params, post=False):
+    """ Runs an api.php query, following its continuations, and yields the
+    'query' part of each batch of results. Copes with both the old
+    (query-continue) and new (continue) ways of continuing. Queries with long
+    parameters, like lists of names, should be posted. """
+    params = dict(params, action='query', format='json')
+    for (k, v) in params.items():
+        if isinstance(v, unicode):
+            params[k] = v.encode('utf-8')
+    while True:
+        if post:
+            f = wikisession.shared().post(url, params)
+        else:
+            f = wikisession.shared().get(url, params)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        if 'error' in data:
+            raise wikisession.APIError(data['error'].get('code'),
+                    data['error'].get('info'))
+        yield data.get('query', {})
+        if 'continue' in data:
+            params.update(data['continue'])
+        elif 'query-continue' in data:
+            for module in data['query-continue'].values():
+                params.update(module)
+        else:
+            return
+
+
+def iter_api_users(site, fromUser=None, url=None):
+    """ Yields every user from api.php's list=allusers, alphabetically from
+    fromUser, as many at a time as the wiki will allow. Their edit counts,
+    registration dates and block details come back in the same request, so
+    isBlocked() doesn't have to go back to the wiki. Unlike the list page,
+    this can't say who has a user page. """
+    params = {'list': 'allusers', 'aulimit': 'max', 'auprop': API_PROPS}
+    if fromUser:
+        params['aufrom'] = fromUser
+    for batch in api_query(url or wikisession.api_url(site), params):
+        for info in batch.get('allusers', []):
+            new_user = UserRecord(site, info['name'])
+            new_user.forceInfo(info)
+            yield new_user
+
+
+def block_batch_size(url):
+    """ How many users we can ask about at once: 500 if we have the
+    apihighlimits right (bots and sysops), otherwise 50. """
+    for q in api_query(url, {'meta': 'userinfo', 'uiprop': 'rights'}):
+        if 'apihighlimits' in q.get('userinfo', {}).get('rights', []):
+            return 500
+    return 50
+
+
+def lookup_blocks(url, users):
+    """ Asks about all of users in one list=users query, and tells each of
+    them whether they're blocked. Users the wiki doesn't know about any more
+    count as not blocked. The names are posted, as 500 of them are too many
+    for a url. """
+    if not users:
+        return
+    params = {'list': 'users', 'usprop': 'blockinfo',
+            'ususers': '|'.join([u.name() for u in users])}
+    found = {}
+    normalized = {}
+    for q in api_query(url, params, post=True):
+        for n in q.get('normalized', []):
+            normalized[n['from']] = n['to']
+        for info in q.get('users', []):
+            found[info['name']] = info
+    for u in users:
+        info = found.get(normalized.get(u.name(), u.name()), {})
+        u.forceBlocked('blockedby' in info)
+
+
+def lookup_unknown_blocks(url, users):
+    """ lookup_blocks for those of users whose block status we don't know
+    yet. Returns users. """
+    lookup_blocks(url, [u for u in users
+        if getattr(u, 'blocked', None) is None])
+    return users
+
+
+def with_block_status(site, users, batch=None, url=None):
+    """ Passes users straight through, having found out whether they're
+    blocked `batch` users at a time (by default, as many as we're allowed),
+    so isBlocked() doesn't cost a request per user. Users whose block status
+    we already know aren't asked about again. """
+    url = url or wikisession.api_url(site)
+    batch = batch or block_batch_size(url)
+    chunk = []
+    for user in users:
+        chunk.append(user)
+        if len(chunk) >= batch:
+            for u in lookup_unknown_blocks(url, chunk):
+                yield u
+            chunk = []
+    for u in lookup_unknown_blocks(url, chunk):
+        yield u
 
 
 class UserFromUserList(userlib.User):
@@ -58,29 +238,126 @@ class UserFromUserList(userlib.User):
     def forceUserPage(self, exist = True):
         self.user_page_exists = exist
 
+    def forceInfo(self, info):
+        """ Keeps what api.php told us about the user: editcount,
+        registration and, if they're blocked, blockedby and friends. """
+        self.info = info
+        self.forceBlocked('blockedby' in info)
+
+    def forceBlocked(self, blocked=True):
+        """ Block status we found out in bulk, so isBlocked() can answer
+        without asking the wiki again. """
+        self.blocked = blocked
+
+    def isBlocked(self, force=False):
+        if not force and getattr(self, 'blocked', None) is not None:
+            return self.blocked
+        return userlib.User.isBlocked(self, force)
+
+
+class UserRecord(object):
+    """ What the user lists hand back: a name and the hints we picked up
+    along the way, in a fraction of the space of a userlib.User. The full
+    UserFromUserList is only built, by user(), when something needs it, and
+    anything a UserRecord doesn't have itself is passed on to that. """
+    __slots__ = ('_site', 'username', 'user_page_exists', 'blocked', 'info',
+            '_user')
+
+    def __init__(self, site, username):
+        self._site = site
+        self.username = username
+        self.user_page_exists = None
+        self.blocked = None
+        self.info = None
+        self._user = None
+
+    def name(self):
+        return self.username
+
+    def site(self):
+        return self._site
+
+    def hadUserPage(self):
+        if self.user_page_exists is None:
+            return True
+        return self.user_page_exists
+
+    def forceUserPage(self, exist=True):
+        self.user_page_exists = exist
+
+    def forceInfo(self, info):
+        self.info = info
+        self.blocked = 'blockedby' in info
+
+    def forceBlocked(self, blocked=True):
+        self.blocked = blocked
+
+    def isBlocked(self, force=False):
+        if not force and self.blocked is not None:
+            return self.blocked
+        return self.user().isBlocked(force)
+
+    def user(self):
+        if self._user is None:
+            u = UserFromUserList(self._site, self.username)
+            if self.user_page_exists is not None:
+                u.forceUserPage(self.user_page_exists)
+            if self.info is not None:
+                u.forceInfo(self.info)
+            if self.blocked is not None:
+                u.forceBlocked(self.blocked)
+            self._user = u
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.user(), name)
+
+    def __str__(self):
+        return str(self.user())
+
+
+def _is_user_link(a):
+    """ Matches 'div.mw-spcontent > ul > li > a' while the page is still
+    being parsed. """
+    e = a
+    for tag in ('li', 'ul', 'div'):
+        e = e.getparent()
+        if e is None or e.tag != tag:
+            return False
+    return 'mw-spcontent' in e.get('class', '').split()
+
 
 class UserListPage:
-    """ When fed a Wikipedia site and a mechanize response to a user list page,
-    will parse and return a list of users. """
+    """ When fed a Wikipedia site and a response (mechanize, urllib2 or
+    wikisession) to a user list page, will parse and return a list of users.
+    The page is parsed as it's read, and thrown away as it goes, so only the
+    users it yields take up memory.
+    Once it's been read, next_url is the page's "next" link, if it had one.
+    """
     def __init__(self, site, response):
         self.response = response
-        self.lxml_root = html.parse(self.response).getroot()
         self.site = site
+        self.next_url = None
+
+    def iterUsers(self):
+        for (event, elem) in etree.iterparse(self.response, html=True):
+            if elem.tag == 'a':
+                if self.next_url is None and \
+                        'mw-nextlink' in elem.get('class', '').split():
+                    self.next_url = urlparse.urljoin(
+                            self.response.geturl(), elem.get('href'))
+                elif 'User:' in elem.get('href', '') and _is_user_link(elem):
+                    new_user = UserRecord(self.site, elem.text)
+                    new_user.forceUserPage(elem.get('class') != 'new')
+                    yield new_user
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
 
     def getUsers(self):
-        ula = cssselect.CSSSelector('div.mw-spcontent > ul > li > a')
-        list_links = ula(self.lxml_root)
-        total_users = []
-        for link in list_links:
-            if 'User:' not in link.attrib['href']:
-                continue
-            new_user = UserFromUserList(self.site, link.text)
-            total_users.append(new_user)
-            if link.get('class') == 'new':
-                new_user.forceUserPage(False)
-            else:
-                new_user.forceUserPage(True)
-        return total_users
+        return list(self.iterUsers())
 
 
 class UserListPageTest(unittest.TestCase):
@@ -102,7 +379,7 @@ class UserListPageTest(unittest.TestCase):
 
     def test_canFindOneUser(self):
         up = UserListPage(self.noisebridge, self.r)
-        self.assertIsInstance(up.getUsers()[0], userlib.User)
+        self.assertIsInstance(up.getUsers()[0].user(), userlib.User)
 
     def test_canFindSpecificUser(self):
         up = UserListPage(self.noisebridge, self.r)
@@ -114,6 +391,39 @@ class UserListPageTest(unittest.TestCase):
         gu = up.getUsers()
         self.assertEquals(len(gu), 500)
 
+    def test_canIterateOverUsers(self):
+        up = UserListPage(self.noisebridge, self.r)
+        gu = up.iterUsers()
+        self.assertEquals(gu.next().name(), 'Blackwing')
+        self.assertEquals(len(list(gu)), 499)
+        self.assertEquals(up.next_url, None)
+
+    def test_followsNextLinks(self):
+        d = tempfile.mkdtemp()
+        try:
+            page = '<html><body><div class="mw-spcontent"><ul>' + \
+                '<li><a href="/wiki/User:%s">%s</a></li></ul>%s</div>' + \
+                '</body></html>'
+            open(os.path.join(d, 'two.html'), 'w').write(
+                    page % ('Second', 'Second', ''))
+            open(os.path.join(d, 'one.html'), 'w').write(page % ('First',
+                'First', '<a class="mw-nextlink" href="two.html">next</a>'))
+            up = user_list_from_url(self.noisebridge,
+                    'file://' + os.path.join(d, 'one.html'))
+            users = [u.name() for u in up.iterUsers()]
+            self.assertEquals(users, ['First'])
+            self.assertEquals(up.next_url,
+                    'file://' + os.path.join(d, 'two.html'))
+        finally:
+            shutil.rmtree(d)
+
+    def test_userRecordsPassHintsOn(self):
+        up = UserListPage(self.noisebridge, self.r)
+        emma = [i for i in up.getUsers() if i.name() == 'EmmaWatson0'][0]
+        self.assertFalse(emma.user().hadUserPage())
+        self.assertTrue(emma.user() is emma.user())
+        self.assertEquals(emma.site(), emma.user().site())
+
     def test_canDiscoverWhoHasUserListPage(self):
         up = UserListPage(self.noisebridge, self.r)
         gu = up.getUsers()
@@ -125,6 +435,185 @@ class UserListPageTest(unittest.TestCase):
         self.assertTrue('EmmaWatson0' not in [i.name() for i in with_userpages])
  
 
+class ShardedListing(unittest.TestCase):
+    def setUp(self):
+        self.names = ['Aardvark', 'Alice', 'Bob', 'Mallory', 'Zed',
+                u'\xc9mile']
+        self.asked = []
+
+    def lister(self, site, first, last, url=None):
+        """ Lists one range, and the first user of the next, like a list page
+        that overlaps. """
+        self.asked.append((first, last))
+        return [UserRecord(site, n) for n in self.names
+                if n >= first and (last is None or n <= last)]
+
+    def test_shardsComeBackInOrderOnce(self):
+        users = iter_users_sharded(None, ['', 'B', 'M'], lister=self.lister)
+        self.assertEquals([u.name() for u in users], self.names)
+        self.assertEquals(sorted(self.asked),
+                [('', 'B'), ('B', 'M'), ('M', None)])
+
+    def test_defaultShardsCoverEveryone(self):
+        users = iter_users_sharded(None, lister=self.lister)
+        self.assertEquals([u.name() for u in users], self.names)
+        self.assertEquals(len(self.asked), 26)
+
+
+class StubApi(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Enough of api.php for the tests: `users` users called User00000
+    onwards, every third one blocked, for list=allusers and list=users, and
+    `rights` for meta=userinfo. `legacy` makes it continue the way wikis
+    before 1.21 did. Each query is kept in `calls`. """
+    users = 1200
+    max_limit = 500
+    legacy = False
+    rights = []
+    calls = []
+
+    def user_info(self, name):
+        info = {'name': name, 'editcount': 1,
+                'registration': '2012-06-22T08:52:12Z'}
+        if int(name[4:]) % 3 == 0:
+            info.update({'blockid': 1, 'blockedby': 'Secretaribot',
+                'blockreason': 'Spam', 'blockexpiry': 'infinity'})
+        return info
+
+    def list_users(self, q):
+        data = {'query': {'users': [], 'normalized': []}}
+        for name in q['ususers'].split('|'):
+            if name[:1].upper() + name[1:] != name:
+                data['query']['normalized'].append({'from': name,
+                    'to': name[:1].upper() + name[1:]})
+                name = name[:1].upper() + name[1:]
+            if name.startswith('User') and name[4:].isdigit() and \
+                    int(name[4:]) < self.users:
+                info = self.user_info(name)
+                del info['editcount'], info['registration']
+            else:
+                info = {'name': name, 'missing': ''}
+            data['query']['users'].append(info)
+        return data
+
+    def do_GET(self):
+        self.answer(dict(urlparse.parse_qsl(
+            urlparse.urlsplit(self.path).query)))
+
+    def do_POST(self):
+        q = dict(urlparse.parse_qsl(self.rfile.read(
+            int(self.headers['Content-Length']))))
+        self.answer(dict(q, posted=True))
+
+    def answer(self, q):
+        self.calls.append(q)
+        if q.get('list') == 'users':
+            data = self.list_users(q)
+        elif q.get('meta') == 'userinfo':
+            data = {'query': {'userinfo': {'id': 1, 'name': 'Secretaribot',
+                'rights': self.rights}}}
+        else:
+            data = self.list_allusers(q)
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def list_allusers(self, q):
+        limit = q.get('aulimit', '10')
+        limit = limit == 'max' and self.max_limit or int(limit)
+        names = ['User%05d' % i for i in range(self.users)]
+        names = [n for n in names if n >= q.get('aufrom', '')]
+        data = {'query': {'allusers': [self.user_info(name)
+            for name in names[:limit]]}}
+        if len(names) > limit:
+            if self.legacy:
+                data['query-continue'] = {'allusers':
+                        {'aufrom': names[limit]}}
+            else:
+                data['continue'] = {'aufrom': names[limit],
+                        'continue': '-||'}
+        return data
+
+    def log_message(self, *args):
+        pass
+
+
+class ApiUserList(unittest.TestCase):
+    def setUp(self):
+        self.noisebridge = wikipedia.Site('en')
+        (self.server, base) = httppool.stub_server(StubApi)
+        self.url = base + '/api.php'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        StubApi.legacy = False
+        StubApi.rights = []
+        StubApi.calls[:] = []
+
+    def test_listsSinceAnyName(self):
+        for name in ['John Smith', u'\xc9mile']:
+            list(iter_users_since_user(self.noisebridge, name,
+                url=self.url))
+        self.assertEquals([c['username'] for c in StubApi.calls],
+                ['John Smith', '\xc3\x89mile'])
+
+    def test_followsContinuations(self):
+        users = list(iter_api_users(self.noisebridge, url=self.url))
+        self.assertEquals(len(users), 1200)
+        self.assertEquals(users[-1].name(), 'User01199')
+        self.assertIsInstance(users[0], UserRecord)
+
+    def test_followsLegacyContinuations(self):
+        StubApi.legacy = True
+        users = list(iter_api_users(self.noisebridge, url=self.url))
+        self.assertEquals(len(users), 1200)
+
+    def test_startsFromUser(self):
+        users = iter_api_users(self.noisebridge, 'User01000', url=self.url)
+        self.assertEquals([u.name() for u in users][:2],
+                ['User01000', 'User01001'])
+
+    def test_knowsWhoIsBlocked(self):
+        users = list(iter_api_users(self.noisebridge, url=self.url))
+        self.assertTrue(users[0].isBlocked())
+        self.assertFalse(users[1].isBlocked())
+        self.assertEquals(users[1].info['editcount'], 1)
+
+    def test_looksUpBlocksInBatches(self):
+        users = [UserRecord(self.noisebridge, 'User%05d' % i)
+                for i in range(120)]
+        checked = list(with_block_status(self.noisebridge, users,
+            url=self.url))
+        self.assertEquals(checked, users)
+        self.assertEquals([u.isBlocked() for u in checked[:4]],
+                [True, False, False, True])
+        self.assertEquals([c.get('meta') or c.get('list')
+            for c in StubApi.calls], ['userinfo'] + ['users'] * 3)
+        self.assertTrue(StubApi.calls[-1].get('posted'))
+
+    def test_bigBatchesWithApiHighLimits(self):
+        StubApi.rights = ['read', 'apihighlimits']
+        self.assertEquals(block_batch_size(self.url), 500)
+        StubApi.rights = ['read']
+        self.assertEquals(block_batch_size(self.url), 50)
+
+    def test_blockLookupsCopeWithOddNames(self):
+        users = [UserRecord(self.noisebridge, n)
+                for n in ['user00003', 'Nobody']]
+        lookup_blocks(self.url, users)
+        self.assertEquals([u.blocked for u in users], [True, False])
+
+    def test_knownBlocksArentLookedUpAgain(self):
+        users = list(iter_api_users(self.noisebridge, url=self.url))[:10]
+        del StubApi.calls[:]
+        list(with_block_status(self.noisebridge, users, batch=50,
+            url=self.url))
+        self.assertEquals(StubApi.calls, [])
+
+
 def main(args):
     """ FIXME put your command runner here """ 
     pass
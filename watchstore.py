@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+##
+# watchstore.py
+###
+"""watchstore.py
+
+Local SQLite record of what www_watch has seen: a copy of each watchlist page
+(and which revision it was), the last etag and last-modified date for every
+url, a history of every check (when, how long it took, and whether anything
+had changed), and which urls and hosts have been failing lately.
+
+Usage: watchstore.py [--store=file] [--changed=days]
+ Lists the urls that changed in the last few days (default 7).
+
+"""
+
+__version__ = "0.1"
+__author__ = "Danny O'Brien <http://www.spesh.com/danny/>"
+__copyright__ = "Copyright Danny O'Brien"
+__contributors__ = None
+__license__ = "GPL v3"
+
+import sqlite3
+import time
+import os
+import tempfile
+import shutil
+import unittest
+
+DEFAULT_STORE = os.path.expanduser('~/.www_watch.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pages (
+    title TEXT PRIMARY KEY,
+    markup TEXT,
+    fetched REAL,
+    revision INTEGER);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    checked REAL,
+    changed REAL,
+    elapsed REAL);
+CREATE TABLE IF NOT EXISTS history (
+    url TEXT,
+    checked REAL,
+    elapsed REAL,
+    etag TEXT,
+    last_modified TEXT,
+    changed INTEGER);
+CREATE INDEX IF NOT EXISTS history_by_time ON history (checked);
+CREATE TABLE IF NOT EXISTS failing_urls (
+    url TEXT PRIMARY KEY,
+    failures INTEGER,
+    retry_at REAL);
+CREATE TABLE IF NOT EXISTS failing_hosts (
+    host TEXT PRIMARY KEY,
+    failures INTEGER,
+    retry_at REAL);
+'''
+
+
+class WatchStore:
+    """ Wraps the SQLite file. Nothing is written to disk until commit(). """
+    def __init__(self, path=DEFAULT_STORE):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        columns = [r[1] for r in self.db.execute('PRAGMA table_info(pages)')]
+        if 'revision' not in columns:
+            self.db.execute('ALTER TABLE pages ADD COLUMN revision INTEGER')
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def save_page(self, title, markup, revision=None, now=None):
+        """ Keeps a copy of a watchlist page. revision is the wiki's
+        revision id for it, if we know it. """
+        self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+                (title, markup, now or time.time(), revision))
+
+    def drop_page(self, title):
+        self.db.execute('DELETE FROM pages WHERE title = ?', (title,))
+
+    def pages(self):
+        """ (title, markup, revision) for every watchlist page we have a
+        copy of. """
+        return [(r['title'], r['markup'], r['revision']) for r in
+                self.db.execute('SELECT title, markup, revision FROM pages '
+                    'ORDER BY title')]
+
+    def get(self, url):
+        """ What we last saw of url, as a dict, or None. """
+        r = self.db.execute('SELECT * FROM urls WHERE url = ?',
+                (url,)).fetchone()
+        if r is None:
+            return None
+        return dict(zip(r.keys(), r))
+
+    def record(self, url, etag, last_modified, elapsed, now=None):
+        """ Notes a check of url. Returns whether the url had changed since
+        the last time; the first check of a url doesn't count as a change. """
+        now = now or time.time()
+        old = self.get(url)
+        changed = (old is not None and
+                (old['etag'], old['last_modified']) != (etag, last_modified))
+        if old is None:
+            when_changed = None
+        elif changed:
+            when_changed = now
+        else:
+            when_changed = old['changed']
+        self.db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, now, when_changed, elapsed))
+        self.db.execute('INSERT INTO history VALUES (?, ?, ?, ?, ?, ?)',
+                (url, now, elapsed, etag, last_modified, int(changed)))
+        return changed
+
+    def changed_since(self, when):
+        """ (time, url, etag, last_modified) for every change seen since when,
+        oldest first. """
+        return [tuple(r) for r in self.db.execute('SELECT checked, url, etag, '
+            'last_modified FROM history WHERE changed AND checked >= ? '
+            'ORDER BY checked', (when,))]
+
+    def failures(self):
+        """ ({url: (failures, retry_at)}, {host: (failures, retry_at)}) """
+        urls = dict((r[0], (r[1], r[2])) for r in
+                self.db.execute('SELECT * FROM failing_urls'))
+        hosts = dict((r[0], (r[1], r[2])) for r in
+                self.db.execute('SELECT * FROM failing_hosts'))
+        return (urls, hosts)
+
+    def save_failures(self, urls, hosts):
+        """ Replaces the failure records with these, in the same shape as
+        failures() returns them. """
+        self.db.execute('DELETE FROM failing_urls')
+        self.db.execute('DELETE FROM failing_hosts')
+        self.db.executemany('INSERT INTO failing_urls VALUES (?, ?, ?)',
+                [(k, f, r) for (k, (f, r)) in urls.items()])
+        self.db.executemany('INSERT INTO failing_hosts VALUES (?, ?, ?)',
+                [(k, f, r) for (k, (f, r)) in hosts.items()])
+
+
+class WatchStoreRecords(unittest.TestCase):
+    def setUp(self):
+        self.store = WatchStore(':memory:')
+
+    def test_firstCheckIsNotAChange(self):
+        self.assertFalse(self.store.record('http://a/', 'x', 'y', 0.1, 100))
+        self.assertEqual(self.store.get('http://a/')['etag'], 'x')
+        self.assertEqual(self.store.get('http://a/')['changed'], None)
+
+    def test_newValuesAreAChange(self):
+        self.store.record('http://a/', 'x', 'y', 0.1, 100)
+        self.assertFalse(self.store.record('http://a/', 'x', 'y', 0.1, 200))
+        self.assertTrue(self.store.record('http://a/', 'z', 'y', 0.1, 300))
+        self.assertEqual(self.store.get('http://a/')['changed'], 300)
+        self.assertEqual(self.store.changed_since(250),
+                [(300, 'http://a/', 'z', 'y')])
+        self.assertEqual(self.store.changed_since(400), [])
+
+    def test_keepsCopiesOfPages(self):
+        self.store.save_page('Watchlist', '{|\n|}', 1)
+        self.store.save_page('Watchlist', '{|\n|-\n|}', 2)
+        self.store.save_page('Watchlist/2', '{|\n|}')
+        self.assertEqual(self.store.pages(), [('Watchlist', '{|\n|-\n|}', 2),
+            ('Watchlist/2', '{|\n|}', None)])
+        self.store.drop_page('Watchlist/2')
+        self.assertEqual(self.store.pages(), [('Watchlist', '{|\n|-\n|}', 2)])
+
+    def test_addsRevisionsToOldStores(self):
+        path = os.path.join(tempfile.mkdtemp(), 'old.db')
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE pages (title TEXT PRIMARY KEY, markup TEXT, '
+                'fetched REAL)')
+        db.execute("INSERT INTO pages VALUES ('Watchlist', '{|\n|}', 1)")
+        db.commit()
+        db.close()
+        try:
+            self.assertEqual(WatchStore(path).pages(),
+                    [('Watchlist', '{|\n|}', None)])
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_keepsFailures(self):
+        self.store.save_failures({'http://a/': (2, 100.0)},
+                {'a': (3, 200.0)})
+        self.assertEqual(self.store.failures(),
+                ({'http://a/': (2, 100.0)}, {'a': (3, 200.0)}))
+        self.store.save_failures({}, {})
+        self.assertEqual(self.store.failures(), ({}, {}))
+
+    def test_unknownUrlsAreNone(self):
+        self.assertEqual(self.store.get('http://b/'), None)
+
+
+options = {'store': DEFAULT_STORE, 'changed': 7}
+
+
+def main(args):
+    store = WatchStore(options['store'])
+    since = time.time() - options['changed'] * 24 * 60 * 60
+    for (when, url, etag, last_modified) in store.changed_since(since):
+        print time.strftime('%Y-%m-%d %H:%M', time.localtime(when)), url
+    store.close()
+
+import sys
+import getopt
+
+
+class Main():
+    """ Encapsulates option handling. Subclass to add new options,
+        add 'handle_x' method for an -x option,
+        add 'handle_xlong' method for an --xlong option
+        help (-h, --help) should be automatically created from module
+        docstring and handler docstrings.
+        test (-t, --test) will run all docstring and unittests it finds
+        options listed in takes_argument expect a value (--x=value)
+        """
+    takes_argument = ['store', 'changed']
+
+    class Usage(Exception):
+        """ Use this to generate a Usage message """
+        def __init__(self, msg):
+            self.msg = msg
+
+    def __init__(self):
+        handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
+        self.shortopts = ''.join([i + ':' * (i in self.takes_argument)
+            for i in handlers if len(i) == 1])
+        self.longopts = [i + '=' * (i in self.takes_argument)
+            for i in handlers if (len(i) > 1)]
+
+    def handler(self, option):
+        i = 'handle_%s' % option.lstrip('-').rstrip('=:')
+        if hasattr(self, i):
+            return getattr(self, i)
+
+    def default_main(self, args):
+        print sys.argv[0], " called with ", args
+
+    def handle_help(self, v):
+        """ Shows this message """
+        print sys.modules.get(__name__).__doc__
+        descriptions = {}
+        for i in list(self.shortopts.replace(':', '')) + self.longopts:
+            d = self.handler(i).__doc__
+            if d in descriptions:
+                descriptions[d].append(i)
+            else:
+                descriptions[d] = [i]
+        for d, opts in descriptions.iteritems():
+            for i in opts:
+                if len(i) == 1:
+                    print '-%s' % i,
+                else:
+                    print '--%s' % i,
+            print
+            print d
+        sys.exit(0)
+    handle_h = handle_help
+
+    def handle_test(self, v):
+        """ Runs test suite for file """
+        import doctest
+        import unittest
+        suite = unittest.defaultTestLoader.loadTestsFromModule(
+                sys.modules.get(__name__))
+        suite.addTest(doctest.DocTestSuite())
+        runner = unittest.TextTestRunner()
+        runner.run(suite)
+        sys.exit(0)
+    handle_t = handle_test
+
+    def handle_store(self, v):
+        """ The store file (default ~/.www_watch.db) """
+        options['store'] = v
+
+    def handle_changed(self, v):
+        """ List the urls that changed in this many days """
+        options['changed'] = float(v)
+
+    def run(self, main=None, argv=None):
+        """ Execute main function, having stripped out options and called the
+        responsible handler functions within the class. Main defaults to
+        listing the remaining arguments.
+        """
+        if not callable(main):
+            main = self.default_main
+        if argv is None:
+            argv = sys.argv
+        try:
+            try:
+                opts, args = getopt.getopt(argv[1:],
+                        self.shortopts, self.longopts)
+            except getopt.error, msg:
+                raise self.Usage(msg)
+            for o, a in opts:
+                (self.handler(o))(a)
+            return main(args)
+        except self.Usage, err:
+            print >>sys.stderr, err.msg
+            self.handle_help(None)
+            return 2
+
+if __name__ == "__main__":
+    sys.exit(Main().run(main) or 0)
@@ -0,0 +1,703 @@
+#!/usr/bin/env python
+##
+# wikisession.py
+###
+"""wikisession.py
+
+One shared way of talking to the wiki for the scripts that don't go through
+pywikipediabot: keep-alive connections and gzip (from httppool), the
+cookies pywikipediabot logged in with, kept per host and topped up from
+whatever the wiki sends back, and a note of how long every request took.
+
+The write operations (edits, deletes, blocks and user merges) go through
+WikiActions, which fetches a token once and uses it for everything, only
+fetching a new one when the wiki says it's gone bad.
+
+Usage: wikisession.py
+ Runs the tests, the same as with -t.
+
+"""
+
+__version__ = "0.1"
+__author__ = "Danny O'Brien <http://www.spesh.com/danny/>"
+__copyright__ = "Copyright Danny O'Brien"
+__contributors__ = None
+__license__ = "GPL v3"
+
+import time
+import json
+import urllib
+import urllib2
+import urlparse
+import threading
+import Cookie
+import BaseHTTPServer
+import unittest
+
+import httppool
+
+TIMEOUT = 60
+# What MediaWiki's own forms say when the token they were sent is no good;
+# extensions' Special pages may say something else, and pass form() their own
+SESSION_FAILURES = ('loss of session data', 'session hijacking')
+# Special:Nuke doesn't say anything when its token is no good: it just shows
+# its form again
+NUKE_FAILURES = SESSION_FAILURES + ('name="wpEditToken"',)
+# How many titles to ask api.php about at once
+MAX_TITLES = 50
+
+
+class APIError(Exception):
+    pass
+
+
+class BadToken(Exception):
+    pass
+
+
+def host_of(url):
+    return urlparse.urlsplit(url).netloc.rsplit('@', 1)[-1].lower()
+
+
+def utf8(v):
+    if isinstance(v, unicode):
+        return v.encode('utf-8')
+    return v
+
+
+def form_encode(data):
+    """ Like urllib.urlencode, but encodes unicode as UTF-8 and sends a
+    list as the same field over and over. """
+    fields = []
+    for (k, v) in data.items():
+        if isinstance(v, (list, tuple)):
+            fields.extend([(k, utf8(i)) for i in v])
+        else:
+            fields.append((k, utf8(v)))
+    return urllib.urlencode(fields)
+
+
+class WikiSession:
+    """ Wraps an httppool.Pool, adding each host's cookies to the requests
+    that go to it. timings keeps running totals of how many requests there
+    have been, how many failed, how long they took to get their response
+    headers, and which was slowest. """
+    def __init__(self, pool=None, timeout=TIMEOUT):
+        self.pool = pool or httppool.Pool(timeout=timeout)
+        self.jar = {}
+        self.timings = {'requests': 0, 'failed': 0, 'seconds': 0.0,
+                'slowest': 0.0, 'slowest_url': None}
+        self.lock = threading.Lock()
+
+    def add_cookies(self, host, cookies):
+        """ Adds cookies, a Cookie: or Set-Cookie: style string, to those
+        we send to host. """
+        if not cookies:
+            return
+        jar = Cookie.SimpleCookie()
+        jar.load(cookies)
+        self.lock.acquire()
+        try:
+            cookies = self.jar.setdefault(host.lower(), {})
+            for (name, morsel) in jar.items():
+                cookies[name] = morsel.value
+        finally:
+            self.lock.release()
+
+    def login(self, site, sysop=False):
+        """ Picks up the cookies pywikipediabot logged in to site with. """
+        self.add_cookies(host_of(site.siteinfo()['base']),
+                site.cookies(sysop=sysop))
+
+    def cookie_header(self, url):
+        self.lock.acquire()
+        try:
+            cookies = self.jar.get(host_of(url), {})
+            return '; '.join(['%s=%s' % (k, v)
+                for (k, v) in sorted(cookies.items())])
+        finally:
+            self.lock.release()
+
+    def open(self, url, method='GET', data=None, headers={}):
+        """ Makes a request, with data (a dict, or a string) form-encoded
+        as the body, and returns an httppool.Response. """
+        h = dict(headers)
+        cookies = self.cookie_header(url)
+        if cookies:
+            h['Cookie'] = cookies
+        if isinstance(data, dict):
+            data = form_encode(data)
+        if data is not None:
+            h['Content-Type'] = 'application/x-www-form-urlencoded'
+        start = time.time()
+        status = None
+        try:
+            f = self.pool.open(url, method, h, data)
+            status = getattr(f, 'code', None)
+            if 'set-cookie' in getattr(f, 'headers', {}):
+                self.add_cookies(host_of(url), f.headers['set-cookie'])
+            return f
+        except urllib2.HTTPError, e:
+            status = e.code
+            raise
+        finally:
+            self.time(url, status, time.time() - start)
+
+    def time(self, url, status, seconds):
+        self.lock.acquire()
+        try:
+            self.timings['requests'] += 1
+            if status is None or status >= 400:
+                self.timings['failed'] += 1
+            self.timings['seconds'] += seconds
+            if seconds >= self.timings['slowest']:
+                self.timings['slowest'] = seconds
+                self.timings['slowest_url'] = url
+        finally:
+            self.lock.release()
+
+    def get(self, url, params=None):
+        if params:
+            url += ('?' in url and '&' or '?') + form_encode(params)
+        return self.open(url)
+
+    def post(self, url, data):
+        return self.open(url, 'POST', data)
+
+    def report(self):
+        """ How many requests we've made, and how long they took. """
+        t = dict(self.timings)
+        if not t['requests']:
+            return "No requests"
+        return ("%d requests in %.1fs (%.3fs average, slowest %.3fs for %s); "
+                % (t['requests'], t['seconds'], t['seconds'] / t['requests'],
+                    t['slowest'], t['slowest_url']) + self.pool.report())
+
+
+def api_url(site):
+    return urlparse.urljoin(site.siteinfo()['base'], site.apipath())
+
+
+def session_failure(text, failures=SESSION_FAILURES):
+    """ Whether a Special page's reply says the token was bad: whether it
+    has any of failures in it. """
+    return [m for m in failures if m in text] != []
+
+
+class TokenManager:
+    """ Fetches a token once per session and hands out the same one until
+    refresh() is called. Edits, deletes, blocks and merges all take the same
+    token (the csrf token, or the edit token before MediaWiki 1.24). """
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+        self.tokens = {}
+        self.fetches = 0
+        self.lock = threading.Lock()
+
+    def _fetch(self):
+        self.fetches += 1
+        data = json.load(self.session.get(self.url, {'action': 'query',
+            'meta': 'tokens', 'type': 'csrf', 'format': 'json'}))
+        token = data.get('query', {}).get('tokens', {}).get('csrftoken')
+        if token:
+            return token
+        data = json.load(self.session.get(self.url, {'action': 'query',
+            'prop': 'info', 'intoken': 'edit', 'titles': 'Main Page',
+            'format': 'json'}))
+        for page in data.get('query', {}).get('pages', {}).values():
+            if page.get('edittoken'):
+                return page['edittoken']
+        raise APIError('notoken', "Couldn't get a token")
+
+    def get(self):
+        self.lock.acquire()
+        try:
+            if 'csrf' not in self.tokens:
+                self.tokens['csrf'] = self._fetch()
+            return self.tokens['csrf']
+        finally:
+            self.lock.release()
+
+    def refresh(self, stale=None):
+        """ Drops the token, if it's still the stale one, so the next get()
+        fetches a new one. """
+        self.lock.acquire()
+        try:
+            if stale is None or self.tokens.get('csrf') == stale:
+                self.tokens.pop('csrf', None)
+        finally:
+            self.lock.release()
+
+    def retry(self, action):
+        """ Returns action(token). If it raises BadToken, gets a new token and
+        tries once more. """
+        token = self.get()
+        try:
+            return action(token)
+        except BadToken:
+            self.refresh(token)
+            return action(self.get())
+
+
+class WikiActions:
+    """ The things the scripts change on the wiki, as api.php calls through a
+    WikiSession, all sharing one TokenManager. """
+    def __init__(self, site, sysop=True, session=None):
+        self.site = site
+        self.session = session or shared(site, sysop)
+        self.url = api_url(site)
+        self.tokens = TokenManager(self.session, self.url)
+        self.extensions = None
+
+    def post(self, params):
+        """ Posts an api.php action with a token, and returns the reply. """
+        def attempt(token):
+            data = json.load(self.session.post(self.url,
+                dict(params, format='json', token=token)))
+            if 'error' in data:
+                if data['error'].get('code') == 'badtoken':
+                    raise BadToken()
+                raise APIError(data['error'].get('code'),
+                        data['error'].get('info'))
+            return data
+        return self.tokens.retry(attempt)
+
+    def edit(self, title, text, summary):
+        return self.post({'action': 'edit', 'title': title, 'text': text,
+            'summary': summary, 'bot': '1'})
+
+    def delete(self, title, reason):
+        return self.post({'action': 'delete', 'title': title,
+            'reason': reason})
+
+    def block(self, user, reason, expiry='infinite', autoblock=True,
+            allowusertalk=False, anononly=False, nocreate=False):
+        params = {'action': 'block', 'user': user, 'reason': reason,
+                'expiry': expiry}
+        for (flag, on) in [('autoblock', autoblock),
+                ('allowusertalk', allowusertalk), ('anononly', anononly),
+                ('nocreate', nocreate)]:
+            if on:
+                params[flag] = '1'
+        return self.post(params)
+
+    def form(self, page, data, token_field='token',
+            failures=SESSION_FAILURES):
+        """ Posts data and a token to a Special page's form, and returns the
+        page that comes back. If the page has any of failures in it, the
+        token has gone bad: a new one is fetched and the form sent again. """
+        url = urlparse.urljoin(self.site.siteinfo()['base'], '/wiki/' + page)
+
+        def attempt(token):
+            text = self.session.post(url,
+                    dict(data, **{token_field: token})).read()
+            if session_failure(text, failures):
+                raise BadToken()
+            return text
+        return self.tokens.retry(attempt)
+
+    def has_extension(self, name):
+        """ Whether the wiki has the extension called name installed. """
+        if self.extensions is None:
+            data = json.load(self.session.get(self.url, {'action': 'query',
+                'meta': 'siteinfo', 'siprop': 'extensions',
+                'format': 'json'}))
+            self.extensions = set([e.get('name') for e in
+                data.get('query', {}).get('extensions', [])])
+        return name in self.extensions
+
+    def missing(self, titles):
+        """ Those of titles that the wiki has no page for. """
+        titles = list(titles)
+        gone = []
+        for start in range(0, len(titles), MAX_TITLES):
+            batch = titles[start:start + MAX_TITLES]
+            data = json.load(self.session.get(self.url, {'action': 'query',
+                'prop': 'info', 'titles': '|'.join(batch),
+                'format': 'json'}))
+            query = data.get('query', {})
+            normalized = dict((n['from'], n['to'])
+                    for n in query.get('normalized', []))
+            absent = set([p['title'] for p in
+                query.get('pages', {}).values() if 'missing' in p])
+            gone.extend([t for t in batch
+                if normalized.get(t, t) in absent])
+        return gone
+
+    def nuke(self, user, titles, reason):
+        """ Has Special:Nuke delete all of titles in one request, and
+        returns the ones that have gone. Nuke's reply doesn't reliably say
+        which it deleted, so the wiki is asked afterwards. """
+        titles = list(titles)
+        self.form('Special:Nuke', {'action': 'delete', 'target': user,
+            'wpReason': reason, 'pages[]': titles}, 'wpEditToken',
+            NUKE_FAILURES)
+        return self.missing(titles)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared(site=None, sysop=False):
+    """ The session all the scripts share, with site's login cookies added
+    if a site is given. """
+    global _shared
+    _shared_lock.acquire()
+    try:
+        if _shared is None:
+            _shared = WikiSession()
+    finally:
+        _shared_lock.release()
+    if site is not None:
+        _shared.login(site, sysop)
+    return _shared
+
+
+class StubCookies(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ /login sets a session cookie; anything else echoes back the
+    cookies and the body it was sent. """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def respond(self, body, cookie=None):
+        self.send_response(200)
+        if cookie:
+            self.send_header('Set-Cookie', cookie)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/login':
+            self.respond('ok', 'wikiSession=abc123; path=/; HttpOnly')
+        else:
+            self.respond(self.headers.get('Cookie', ''))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.respond(self.headers.get('Cookie', '') + '|' + body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubWriteApi(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ An api.php that hands out `token`, and carries out any action sent
+    it with that token. Set `legacy` to hand it out the pre-1.24 way.
+    `actions` keeps what was done, and `deleted` the pages that have gone.
+    Special:Nuke leaves anything in `undeletable` alone. """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    token = 'abc+\\'
+    legacy = False
+    extensions = ['Nuke', 'UserMerge']
+    actions = []
+    deleted = []
+    undeletable = []
+
+    def respond(self, data):
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        q = dict(urlparse.parse_qsl(urlparse.urlsplit(self.path).query))
+        if q.get('meta') == 'tokens' and not self.legacy:
+            self.respond({'query': {'tokens': {'csrftoken': self.token}}})
+        elif q.get('intoken') == 'edit':
+            self.respond({'query': {'pages': {'1': {'title': 'Main Page',
+                'edittoken': self.token}}}})
+        elif q.get('meta') == 'siteinfo':
+            self.respond({'query': {'extensions': [{'type': 'specialpage',
+                'name': name} for name in self.extensions]}})
+        elif q.get('prop') == 'info':
+            pages = {}
+            for (n, title) in enumerate(q['titles'].split('|')):
+                if title in self.deleted:
+                    pages[str(-n - 1)] = {'title': title, 'missing': ''}
+                else:
+                    pages[str(n + 1)] = {'title': title, 'lastrevid': 1}
+            self.respond({'query': {'pages': pages}})
+        else:
+            self.respond({'warnings': {'query': {'*': 'Unrecognized'}}})
+
+    def do_POST(self):
+        fields = urlparse.parse_qsl(self.rfile.read(
+            int(self.headers['Content-Length'])))
+        q = dict(fields)
+        if self.path.startswith('/wiki/Special:Nuke'):
+            self.nuke(q, [v for (k, v) in fields if k == 'pages[]'])
+            return
+        if self.path.startswith('/wiki/Special:UserMerge'):
+            self.merge(q)
+            return
+        if q.get('token') != self.token:
+            self.respond({'error': {'code': 'badtoken',
+                'info': 'Invalid token'}})
+            return
+        self.actions.append(q)
+        if q['action'] == 'delete':
+            self.deleted.append(q['title'])
+        self.respond({q['action']: {'result': 'Success'}})
+
+    def merge(self, q):
+        if q.get('token') != self.token:
+            body = 'Invalid edit token'
+        else:
+            self.actions.append(q)
+            body = 'Merge from %(olduser)s to %(newuser)s is complete.' % q
+        self.page(body)
+
+    def page(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def nuke(self, q, pages):
+        if q.get('wpEditToken') != self.token:
+            body = ('<form><input type="hidden" name="wpEditToken" value="">'
+                    '</form>')
+        else:
+            q['pages[]'] = pages
+            self.actions.append(q)
+            gone = [t for t in pages if t not in self.undeletable]
+            self.deleted.extend(gone)
+            body = ''.join(['Page %s has been deleted.' % t for t in gone])
+        self.page(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeSite:
+    """ Just the parts of a pywikipediabot site that WikiSession and
+    WikiActions use. """
+    def __init__(self, base):
+        self.base = base
+
+    def siteinfo(self):
+        return {'base': self.base + '/wiki/Main_Page'}
+
+    def apipath(self):
+        return '/api.php'
+
+    def cookies(self, sysop=False):
+        return sysop and 'wikiUserName=Sysop; wikiToken=s' or \
+                'wikiUserName=Bot'
+
+
+class WikiSessionKeepsCookies(unittest.TestCase):
+    def setUp(self):
+        (self.server, self.base) = httppool.stub_server(StubCookies)
+        self.session = WikiSession()
+
+    def tearDown(self):
+        self.session.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_usesTheBotsLoginCookies(self):
+        self.session.login(FakeSite(self.base), sysop=True)
+        self.assertEqual(self.session.open(self.base + '/').read(),
+                'wikiToken=s; wikiUserName=Sysop')
+
+    def test_keepsCookiesItIsSent(self):
+        self.session.open(self.base + '/login').read()
+        self.assertEqual(self.session.get(self.base + '/').read(),
+                'wikiSession=abc123')
+
+    def test_cookiesOnlyGoToTheirHost(self):
+        self.session.add_cookies('elsewhere.example.com', 'secret=1')
+        self.assertEqual(self.session.get(self.base + '/').read(), '')
+
+    def test_postsForms(self):
+        self.session.add_cookies(host_of(self.base), 'a=b')
+        self.assertEqual(self.session.post(self.base + '/', {'x': 'y z'})
+                .read(), 'a=b|x=y+z')
+
+    def test_timesRequestsOverOneConnection(self):
+        for i in range(3):
+            self.session.get(self.base + '/', {'n': i}).read()
+        self.assertEqual(self.session.timings['requests'], 3)
+        self.assertEqual(self.session.timings['failed'], 0)
+        self.assert_(self.session.timings['slowest_url'].startswith(
+            self.base + '/?n='))
+        self.assertEqual(self.session.pool.stats['connections'], 1)
+        self.assert_(self.session.report().startswith('3 requests'))
+
+
+class WikiActionsShareTokens(unittest.TestCase):
+    def setUp(self):
+        (self.server, self.base) = httppool.stub_server(StubWriteApi)
+        self.actions = WikiActions(FakeSite(self.base),
+                session=WikiSession())
+
+    def tearDown(self):
+        self.actions.session.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        StubWriteApi.token = 'abc+\\'
+        StubWriteApi.legacy = False
+        StubWriteApi.actions[:] = []
+        StubWriteApi.deleted[:] = []
+        StubWriteApi.undeletable[:] = []
+
+    def test_fetchesTheTokenOnce(self):
+        self.actions.edit('Next meeting', '#REDIRECT [[X]]', 'Moving on')
+        self.actions.delete('Spam page', 'Spam')
+        self.actions.block('Spammer', 'Spam')
+        self.assertEqual(self.actions.tokens.fetches, 1)
+        self.assertEqual([a['action'] for a in StubWriteApi.actions],
+                ['edit', 'delete', 'block'])
+        self.assertEqual(StubWriteApi.actions[2].get('autoblock'), '1')
+        self.assertFalse('allowusertalk' in StubWriteApi.actions[2])
+
+    def test_getsANewTokenWhenTheOldOneGoesBad(self):
+        self.actions.delete('Spam page', 'Spam')
+        StubWriteApi.token = 'def+\\'
+        self.actions.delete('More spam', 'Spam')
+        self.assertEqual(self.actions.tokens.fetches, 2)
+        self.assertEqual(len(StubWriteApi.actions), 2)
+
+    def test_fallsBackToEditTokens(self):
+        StubWriteApi.legacy = True
+        self.assertEqual(self.actions.tokens.get(), 'abc+\\')
+
+    def test_noTokenIsAnError(self):
+        StubWriteApi.token = None
+        self.assertRaises(APIError, self.actions.tokens.get)
+
+    def test_nukesWithTheSameToken(self):
+        self.assertTrue(self.actions.has_extension('Nuke'))
+        self.actions.delete('Spam page', 'Spam')
+        StubWriteApi.token = 'def+\\'
+        gone = self.actions.nuke('Spammer', [u'Spam', u'Sp\xe4m'], 'Spam')
+        nuke = StubWriteApi.actions[-1]
+        self.assertEqual(nuke['pages[]'], ['Spam', 'Sp\xc3\xa4m'])
+        self.assertEqual(nuke['target'], 'Spammer')
+        self.assertEqual(self.actions.tokens.fetches, 2)
+        self.assertEqual(gone, [u'Spam', u'Sp\xe4m'])
+
+    def test_nukeSaysWhichPagesAreStillThere(self):
+        StubWriteApi.undeletable.append('Protected')
+        self.assertEqual(self.actions.nuke('Spammer', ['Spam', 'Protected'],
+            'Spam'), ['Spam'])
+
+    def test_knowsWhenThereIsNoNuke(self):
+        StubWriteApi.extensions = ['UserMerge']
+        try:
+            self.assertFalse(self.actions.has_extension('Nuke'))
+        finally:
+            StubWriteApi.extensions = ['Nuke', 'UserMerge']
+
+    def test_formsGetANewTokenWhenTheirFailureShowsUp(self):
+        self.actions.delete('Spam page', 'Spam')
+        StubWriteApi.token = 'def+\\'
+        text = self.actions.form('Special:UserMerge', {'olduser': 'Spammer',
+            'newuser': 'Spam'}, failures=('Invalid edit token',))
+        self.assertEqual(text, 'Merge from Spammer to Spam is complete.')
+        self.assertEqual(self.actions.tokens.fetches, 2)
+
+    def test_spotsSessionFailures(self):
+        self.assert_(session_failure('Sorry! We could not process your '
+            'edit due to a loss of session data.'))
+        self.failIf(session_failure('Merge from A to B is complete.'))
+
+
+def main(args):
+    """ There's nothing here to run on its own, so runs the tests. """
+    Main().handle_test(None)
+
+import sys
+import getopt
+
+
+class Main():
+    """ Encapsulates option handling. Subclass to add new options,
+        add 'handle_x' method for an -x option,
+        add 'handle_xlong' method for an --xlong option
+        help (-h, --help) should be automatically created from module
+        docstring and handler docstrings.
+        test (-t, --test) will run all docstring and unittests it finds
+        """
+    class Usage(Exception):
+        """ Use this to generate a Usage message """
+        def __init__(self, msg):
+            self.msg = msg
+
+    def __init__(self):
+        handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
+        self.shortopts = ''.join([i for i in handlers if len(i) == 1])
+        self.longopts = [i for i in handlers if (len(i) > 1)]
+
+    def handler(self, option):
+        i = 'handle_%s' % option.lstrip('-')
+        if hasattr(self, i):
+            return getattr(self, i)
+
+    def default_main(self, args):
+        print sys.argv[0], " called with ", args
+
+    def handle_help(self, v):
+        """ Shows this message """
+        print sys.modules.get(__name__).__doc__
+        descriptions = {}
+        for i in list(self.shortopts) + self.longopts:
+            d = self.handler(i).__doc__
+            if d in descriptions:
+                descriptions[d].append(i)
+            else:
+                descriptions[d] = [i]
+        for d, opts in descriptions.iteritems():
+            for i in opts:
+                if len(i) == 1:
+                    print '-%s' % i,
+                else:
+                    print '--%s' % i,
+            print
+            print d
+        sys.exit(0)
+    handle_h = handle_help
+
+    def handle_test(self, v):
+        """ Runs test suite for file """
+        import doctest
+        import unittest
+        suite = unittest.defaultTestLoader.loadTestsFromModule(
+                sys.modules.get(__name__))
+        suite.addTest(doctest.DocTestSuite())
+        runner = unittest.TextTestRunner()
+        runner.run(suite)
+        sys.exit(0)
+    handle_t = handle_test
+
+    def run(self, main=None, argv=None):
+        """ Execute main function, having stripped out options and called the
+        responsible handler functions within the class. Main defaults to
+        listing the remaining arguments.
+        """
+        if not callable(main):
+            main = self.default_main
+        if argv is None:
+            argv = sys.argv
+        try:
+            try:
+                opts, args = getopt.getopt(argv[1:],
+                        self.shortopts, self.longopts)
+            except getopt.error, msg:
+                raise self.Usage(msg)
+            for o, a in opts:
+                (self.handler(o))(a)
+            return main(args)
+        except self.Usage, err:
+            print >>sys.stderr, err.msg
+            self.handle_help(None)
+            return 2
+
+if __name__ == "__main__":
+    sys.exit(Main().run(main) or 0)
@@ -0,0 +1,548 @@
+#!/usr/bin/env python
+##
+# workpool.py
+###
+"""workpool.py
+
+Small thread pool helpers shared by the other scripts. Runs a function over a
+list of items with a cap on the total number of workers, and optionally on the
+number of workers per key (eg per host), handing results back in the order
+the items came in. Also a pipeline version that hands results back as they
+finish, a prefetcher that works a few items ahead of whoever is using the
+results, a version of that for functions that yield a long stream of results,
+and a rate limiter to share between threads.
+
+Usage: workpool.py
+ Runs the tests, the same as with -t.
+
+"""
+
+__version__ = "0.1"
+__author__ = "Danny O'Brien <http://www.spesh.com/danny/>"
+__copyright__ = "Copyright Danny O'Brien"
+__contributors__ = None
+__license__ = "GPL v3"
+
+import threading
+import collections
+import Queue
+import unittest
+import time
+
+_STOP = object()
+_DONE = object()
+
+
+class Dispatcher:
+    """ Hands out (position, item) pairs to worker threads, never letting more
+    than per_key items with the same key be out at once. Items are queued per
+    key, so a busy host doesn't hold up the items queued behind it for other
+    hosts. """
+    def __init__(self, items, key=None, per_key=None):
+        self.key = key or (lambda item: None)
+        self.per_key = per_key
+        self.queues = collections.OrderedDict()
+        self.busy = {}
+        self.stopped = False
+        self.cond = threading.Condition()
+        for n, item in enumerate(items):
+            k = self.key(item)
+            self.queues.setdefault(k, collections.deque()).append((n, item))
+
+    def take(self):
+        """ Returns (position, item, key), or None when there's nothing left.
+        Blocks while all remaining items belong to saturated keys. """
+        self.cond.acquire()
+        try:
+            while self.queues and not self.stopped:
+                for k, q in self.queues.iteritems():
+                    if self.per_key is None or self.busy.get(k, 0) < self.per_key:
+                        n, item = q.popleft()
+                        if not q:
+                            del self.queues[k]
+                        self.busy[k] = self.busy.get(k, 0) + 1
+                        return (n, item, k)
+                self.cond.wait()
+            return None
+        finally:
+            self.cond.release()
+
+    def stop(self):
+        """ Hands out nothing more. """
+        self.cond.acquire()
+        try:
+            self.stopped = True
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def done(self, k):
+        self.cond.acquire()
+        try:
+            self.busy[k] -= 1
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+
+def map_ordered(func, items, workers=8, key=None, per_key=None,
+        deadline=None, missing=None):
+    """ Like map(func, items), but spread over up to `workers` threads. If key
+    is given, at most per_key calls with the same key(item) run at once.
+    Results come back in the same order as items. If any call raised, the
+    first exception (in item order) is re-raised once all the work is done.
+
+    If deadline (a time.time()) is given, it returns then even if there's
+    work left: items that hadn't finished get `missing` as their result, and
+    calls still running are left to finish in the background. """
+    items = list(items)
+    results = [None] * len(items)
+    finished = set()
+    lock = threading.Lock()
+    errors = {}
+    dispatcher = Dispatcher(items, key, per_key)
+
+    def worker():
+        while True:
+            job = dispatcher.take()
+            if job is None:
+                return
+            (n, item, k) = job
+            try:
+                result = func(item)
+                lock.acquire()
+                results[n] = result
+                finished.add(n)
+                lock.release()
+            except Exception, e:
+                errors[n] = e
+            finally:
+                dispatcher.done(k)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(max(1, min(workers, len(items))))]
+    for t in threads:
+        t.setDaemon(deadline is not None)
+        t.start()
+    for t in threads:
+        if deadline is None:
+            t.join()
+        else:
+            t.join(max(0, deadline - time.time()))
+    dispatcher.stop()
+    lock.acquire()
+    results = list(results)
+    for n in range(len(items)):
+        if n not in finished:
+            results[n] = missing
+    lock.release()
+    if errors:
+        raise errors[min(errors.keys())]
+    return results
+
+
+def imap_unordered(func, items, workers=8, backlog=None):
+    """ Runs func over items on up to `workers` threads, yielding (item,
+    result, exception) as each call finishes; exception is None if it didn't
+    raise. items can be a generator: it's only read from in the calling
+    thread, and only when fewer than backlog (by default twice the workers)
+    items are waiting or running, so it can be a slow earlier stage of a
+    pipeline. """
+    backlog = backlog or workers * 2
+    todo = Queue.Queue()
+    done = Queue.Queue()
+
+    def worker():
+        while True:
+            item = todo.get()
+            if item is _STOP:
+                return
+            try:
+                done.put((item, func(item), None))
+            except Exception, e:
+                done.put((item, None, e))
+
+    threads = [threading.Thread(target=worker) for i in range(workers)]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    items = iter(items)
+    pending = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and pending < backlog:
+                try:
+                    todo.put(items.next())
+                    pending += 1
+                except StopIteration:
+                    exhausted = True
+            if not pending:
+                return
+            r = done.get()
+            pending -= 1
+            yield r
+    finally:
+        for t in threads:
+            todo.put(_STOP)
+
+
+def prefetch(func, items, ahead=5):
+    """ Yields (item, result, exception) for each of items in order, like
+    imap_unordered, but with func already running in the background on the
+    next `ahead` items while the caller deals with this one. items is only
+    read from in the calling thread. """
+    todo = Queue.Queue()
+    window = collections.deque()
+
+    def worker():
+        while True:
+            job = todo.get()
+            if job is _STOP:
+                return
+            (item, slot) = job
+            try:
+                slot.put((func(item), None))
+            except Exception, e:
+                slot.put((None, e))
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, ahead))]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    items = iter(items)
+    try:
+        while True:
+            while len(window) <= ahead:
+                try:
+                    item = items.next()
+                except StopIteration:
+                    break
+                slot = Queue.Queue(1)
+                todo.put((item, slot))
+                window.append((item, slot))
+            if not window:
+                return
+            (item, slot) = window.popleft()
+            (result, error) = slot.get()
+            yield (item, result, error)
+    finally:
+        for t in threads:
+            todo.put(_STOP)
+
+
+def chain_ordered(func, items, workers=4, buffer=500):
+    """ Yields everything func(item) yields, for each of items in turn, like
+    itertools.chain. func runs on up to `workers` items at once: the one being
+    read, and the ones after it. Each keeps no more than `buffer` results
+    waiting, so however much func yields, only that much is held in memory.
+    If func raises, the exception is raised here when its turn comes. items
+    is only read from in the calling thread. """
+    todo = Queue.Queue()
+    window = collections.deque()
+    stopped = threading.Event()
+
+    def put(results, value):
+        while not stopped.isSet():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def worker():
+        while True:
+            job = todo.get()
+            if job is _STOP:
+                return
+            (item, results) = job
+            try:
+                for value in func(item):
+                    if not put(results, (value, None)):
+                        break
+                else:
+                    put(results, (_DONE, None))
+            except Exception, e:
+                put(results, (_DONE, e))
+
+    threads = [threading.Thread(target=worker)
+               for i in range(max(1, workers))]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    items = iter(items)
+    try:
+        while True:
+            while len(window) < max(1, workers):
+                try:
+                    item = items.next()
+                except StopIteration:
+                    break
+                results = Queue.Queue(buffer)
+                todo.put((item, results))
+                window.append(results)
+            if not window:
+                return
+            results = window.popleft()
+            while True:
+                (value, error) = results.get()
+                if value is _DONE:
+                    break
+                yield value
+            if error is not None:
+                raise error
+    finally:
+        stopped.set()
+        for t in threads:
+            todo.put(_STOP)
+
+
+class RateLimiter:
+    """ Spaces out calls to wait(), across all the threads sharing it, so
+    there are no more than `rate` a second. A rate of None doesn't limit. """
+    def __init__(self, rate=None):
+        self.interval = rate and 1.0 / rate or 0
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        self.lock.acquire()
+        now = time.time()
+        when = max(now, self.next)
+        self.next = when + self.interval
+        self.lock.release()
+        if when > now:
+            time.sleep(when - now)
+
+
+class MapOrdered(unittest.TestCase):
+    def test_resultsComeBackInOrder(self):
+        def slow_square(x):
+            time.sleep(0.01 * (5 - x))
+            return x * x
+        self.assertEqual(map_ordered(slow_square, range(5), workers=5),
+                [0, 1, 4, 9, 16])
+
+    def test_emptyListIsFine(self):
+        self.assertEqual(map_ordered(lambda x: x, []), [])
+
+    def test_perKeyLimitIsRespected(self):
+        lock = threading.Lock()
+        running = {}
+        most = {}
+
+        def track(item):
+            lock.acquire()
+            running[item[0]] = running.get(item[0], 0) + 1
+            most[item[0]] = max(most.get(item[0], 0), running[item[0]])
+            lock.release()
+            time.sleep(0.01)
+            lock.acquire()
+            running[item[0]] -= 1
+            lock.release()
+            return item[1]
+        items = [('a', i) for i in range(6)] + [('b', i) for i in range(6)]
+        r = map_ordered(track, items, workers=6,
+                key=lambda item: item[0], per_key=2)
+        self.assertEqual(r, [i for (k, i) in items])
+        self.assertEqual(most, {'a': 2, 'b': 2})
+
+    def test_deadlineLeavesUnfinishedItemsMissing(self):
+        def nap(x):
+            time.sleep(x)
+            return x
+        r = map_ordered(nap, [0, 0, 5, 0], workers=2,
+                deadline=time.time() + 0.5, missing='late')
+        self.assertEqual(r, [0, 0, 'late', 0])
+
+    def test_workersThatDieStillFreeTheirKey(self):
+        def exit_on_one(x):
+            if x == 1:
+                raise SystemExit
+            return x
+        r = map_ordered(exit_on_one, [1, 2], workers=2,
+                key=lambda item: 'a', per_key=1)
+        self.assertEqual(r, [None, 2])
+
+    def test_errorsAreRaised(self):
+        def fail_on_three(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        self.assertRaises(ValueError, map_ordered, fail_on_three, range(5))
+
+
+class Pipeline(unittest.TestCase):
+    def test_everyItemComesBackOnce(self):
+        def fail_on_three(x):
+            if x == 3:
+                raise ValueError(x)
+            return x * x
+        r = list(imap_unordered(fail_on_three, iter(range(10)), workers=3))
+        self.assertEqual(sorted([(i, v) for (i, v, e) in r if e is None]),
+                [(i, i * i) for i in range(10) if i != 3])
+        self.assertEqual([(i, type(e)) for (i, v, e) in r if e],
+                [(3, ValueError)])
+
+    def test_onlyReadsAheadAsFarAsTheBacklog(self):
+        read = []
+
+        def items():
+            for i in range(100):
+                read.append(i)
+                yield i
+        results = imap_unordered(lambda x: x, items(), workers=2, backlog=4)
+        results.next()
+        self.assert_(len(read) <= 5)
+        results.close()
+
+    def test_prefetchKeepsOrderAndWorksAhead(self):
+        started = []
+
+        def look(x):
+            started.append(x)
+            if x == 2:
+                raise ValueError(x)
+            time.sleep(0.01 * (5 - x))
+            return x * 10
+        results = prefetch(look, range(5), ahead=2)
+        self.assertEqual(results.next(), (0, 0, None))
+        time.sleep(0.1)
+        self.assertEqual(sorted(started), [0, 1, 2])
+        rest = list(results)
+        self.assertEqual([(i, r) for (i, r, e) in rest],
+                [(1, 10), (2, None), (3, 30), (4, 40)])
+        self.assertEqual(type(rest[1][2]), ValueError)
+
+    def test_chainKeepsOrderAndStreams(self):
+        finished = []
+
+        def count(x):
+            for i in range(x * 10, x * 10 + 3):
+                time.sleep(0.01 * (3 - x))
+                yield i
+            finished.append(x)
+        results = chain_ordered(count, range(4), workers=2, buffer=1)
+        self.assertEqual(results.next(), 0)
+        self.assertEqual(finished, [])
+        self.assertEqual(list(results),
+                [1, 2, 10, 11, 12, 20, 21, 22, 30, 31, 32])
+
+    def test_chainRaisesInTurn(self):
+        def fail_on_one(x):
+            yield x
+            if x == 1:
+                raise ValueError(x)
+        results = chain_ordered(fail_on_one, range(3))
+        self.assertEqual([results.next(), results.next()], [0, 1])
+        self.assertRaises(ValueError, results.next)
+
+    def test_rateLimiterSpacesCalls(self):
+        limiter = RateLimiter(50)
+        start = time.time()
+        map_ordered(lambda x: limiter.wait(), range(6), workers=3)
+        self.assert_(time.time() - start >= 0.1)
+
+    def test_noRateMeansNoWaiting(self):
+        limiter = RateLimiter()
+        start = time.time()
+        for i in range(100):
+            limiter.wait()
+        self.assert_(time.time() - start < 0.1)
+
+
+def main(args):
+    """ There's nothing here to run on its own, so runs the tests. """
+    Main().handle_test(None)
+
+import sys
+import getopt
+
+
+class Main():
+    """ Encapsulates option handling. Subclass to add new options,
+        add 'handle_x' method for an -x option,
+        add 'handle_xlong' method for an --xlong option
+        help (-h, --help) should be automatically created from module
+        docstring and handler docstrings.
+        test (-t, --test) will run all docstring and unittests it finds
+        """
+    class Usage(Exception):
+        """ Use this to generate a Usage message """
+        def __init__(self, msg):
+            self.msg = msg
+
+    def __init__(self):
+        handlers = [i[7:] for i in dir(self) if i.startswith('handle_')]
+        self.shortopts = ''.join([i for i in handlers if len(i) == 1])
+        self.longopts = [i for i in handlers if (len(i) > 1)]
+
+    def handler(self, option):
+        i = 'handle_%s' % option.lstrip('-')
+        if hasattr(self, i):
+            return getattr(self, i)
+
+    def default_main(self, args):
+        print sys.argv[0], " called with ", args
+
+    def handle_help(self, v):
+        """ Shows this message """
+        print sys.modules.get(__name__).__doc__
+        descriptions = {}
+        for i in list(self.shortopts) + self.longopts:
+            d = self.handler(i).__doc__
+            if d in descriptions:
+                descriptions[d].append(i)
+            else:
+                descriptions[d] = [i]
+        for d, opts in descriptions.iteritems():
+            for i in opts:
+                if len(i) == 1:
+                    print '-%s' % i,
+                else:
+                    print '--%s' % i,
+            print
+            print d
+        sys.exit(0)
+    handle_h = handle_help
+
+    def handle_test(self, v):
+        """ Runs test suite for file """
+        import doctest
+        import unittest
+        suite = unittest.defaultTestLoader.loadTestsFromModule(
+                sys.modules.get(__name__))
+        suite.addTest(doctest.DocTestSuite())
+        runner = unittest.TextTestRunner()
+        runner.run(suite)
+        sys.exit(0)
+    handle_t = handle_test
+
+    def run(self, main=None, argv=None):
+        """ Execute main function, having stripped out options and called the
+        responsible handler functions within the class. Main defaults to
+        listing the remaining arguments.
+        """
+        if not callable(main):
+            main = self.default_main
+        if argv is None:
+            argv = sys.argv
+        try:
+            try:
+                opts, args = getopt.getopt(argv[1:],
+                        self.shortopts, self.longopts)
+            except getopt.error, msg:
+                raise self.Usage(msg)
+            for o, a in opts:
+                (self.handler(o))(a)
+            return main(args)
+        except self.Usage, err:
+            print >>sys.stderr, err.msg
+            self.handle_help(None)
+            return 2
+
+if __name__ == "__main__":
+    sys.exit(Main().run(main) or 0)
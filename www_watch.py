@@ -9,6 +9,39 @@ the headers; by updating these etags on the page, it will trigger a mediawiki
 page change whenever any of the other pages change. If you watch that page,
 you'll be effectively watching all the other external pages.
 
+Pages full of timestamps, session tokens or rotating ads can be hashed after
+stripping scripts, styles and comments (--normalize). An optional "Ignore"
+column adds per-row things to strip before hashing, separated by ';': regular
+expressions, or css:selector to drop whole elements. Rows with anything in
+that column are always normalized.
+
+The watchlist can be split over several pages: --prefix=Secretaribot/Watchlist
+watches every page whose title starts with that, --index=Page every page that
+Page links to. All their rows are checked together, and each page is only
+saved if one of its own rows changed.
+
+With --daemon it keeps running, checking each url when it falls due. Urls
+that keep changing are checked more often (down to --mininterval seconds),
+ones that don't less often (up to --maxinterval); changes are saved to the
+wiki at most every --flush seconds.
+
+With --store=file it keeps a local SQLite record (see watchstore.py) of every
+check, and starts each run from its own copy of the watchlist. One query a run
+finds the latest revision of each watchlist page, and only pages that are new
+or have changed since are read from the wiki (all of them, with --refresh);
+copies of pages no longer on the watchlist are dropped.
+
+Every url gets --timeout seconds for each read and --connecttimeout to connect,
+and the whole run gets --budget seconds of fetching. Rows that fail or run out
+of time keep their old values; if the table has a "Status" column it says
+which rows are ok, stale (out of time) or failing. Whatever finished is saved.
+
+Urls that fail are left alone for a while before being tried again, twice as
+long after each failure (starting at --backoff seconds). A host where
+--hostfailures checks in a row have failed is skipped altogether for
+--hostcooldown seconds, after which one url is tried; if that works, the host
+is back in business. The store remembers all this between runs.
+
 """
 
 __version__ = "0.1"
@@ -19,16 +52,196 @@ __license__ = "GPL v3"
 
 import unittest2 as unittest
 import os
+import sys
+import StringIO
 import urllib2
 import hashlib
+import zlib
 import re
+import copy
+import heapq
+import time
+import json
+import collections
+import threading
+import urlparse
 from pywikipediabot import wikipedia
+import workpool
+import httppool
+import watchstore
+import wikisession
+
+options = {'workers': 8, 'perhost': 2, 'maxbytes': None, 'hash': 'md5',
+        'normalize': False, 'prefix': None, 'index': None, 'daemon': False,
+        'mininterval': 600, 'maxinterval': 86400, 'flush': 900, 'stats': False,
+        'store': None, 'refresh': False, 'budget': None}
+
+MAX_BACKOFF = 24 * 60 * 60
+
+WATCHLIST = 'Secretaribot/Watchlist'
+
+transport = httppool.Pool(timeout=60, connect_timeout=20)
 
 
+class Breaker:
+    """ Remembers failing urls and hosts, and says which to leave alone.
+    A url that has failed n times in a row isn't tried again for backoff *
+    2**(n-1) seconds (up to a day). A host where host_failures checks in a
+    row have failed is opened: nothing on it is tried for host_cooldown
+    seconds, then a single url is let through to probe it. A success
+    anywhere on a host closes it again. """
+    def __init__(self, backoff=300, host_failures=3, host_cooldown=3600):
+        self.backoff = backoff
+        self.host_failures = host_failures
+        self.host_cooldown = host_cooldown
+        self.urls = {}
+        self.hosts = {}
+        self.probing = set()
+        self.lock = threading.Lock()
+
+    def skip(self, url, host, now):
+        """ Why url shouldn't be fetched now ('backoff' or 'host down'), or
+        None if it should. """
+        self.lock.acquire()
+        try:
+            (failures, retry_at) = self.hosts.get(host, (0, 0))
+            if failures >= self.host_failures:
+                if retry_at > now or host in self.probing:
+                    return 'host down'
+                self.probing.add(host)
+                return None
+            if url in self.urls and self.urls[url][1] > now:
+                return 'backoff'
+            return None
+        finally:
+            self.lock.release()
+
+    def succeeded(self, url, host):
+        self.lock.acquire()
+        self.urls.pop(url, None)
+        self.hosts.pop(host, None)
+        self.probing.discard(host)
+        self.lock.release()
+
+    def failed(self, url, host, now):
+        self.lock.acquire()
+        failures = self.urls.get(url, (0, 0))[0] + 1
+        self.urls[url] = (failures,
+                now + min(MAX_BACKOFF, self.backoff * 2 ** (failures - 1)))
+        failures = self.hosts.get(host, (0, 0))[0] + 1
+        self.hosts[host] = (failures, now + self.host_cooldown)
+        self.probing.discard(host)
+        self.lock.release()
+
+    def load(self, store):
+        (self.urls, self.hosts) = store.failures()
+
+    def save(self, store):
+        store.save_failures(self.urls, self.hosts)
+
+breaker = Breaker()
+
+CHUNK_SIZE = 64 * 1024
+TRUNCATED = ' (truncated)'
+
+
+class Crc32:
+    """ hashlib-alike round zlib.crc32, for when md5 is more than we need. """
+    def __init__(self):
+        self.crc = 0
+
+    def update(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+
+    def hexdigest(self):
+        return '%08x' % (self.crc & 0xffffffff)
+
+hashes = {'md5': hashlib.md5, 'crc32': Crc32}
+
+
+def fingerprint(f, max_bytes=None, hash='md5', chunk_size=CHUNK_SIZE):
+    """ Hashes what's left to read in f, a chunk at a time, giving up after
+    max_bytes. Returns (hexdigest, truncated). """
+    h = hashes[hash]()
+    seen = 0
+    while max_bytes is None or seen < max_bytes:
+        if max_bytes is None:
+            chunk = f.read(chunk_size)
+        else:
+            chunk = f.read(min(chunk_size, max_bytes - seen))
+        if not chunk:
+            return (h.hexdigest(), False)
+        h.update(chunk)
+        seen += len(chunk)
+    return (h.hexdigest(), bool(f.read(1)))
+
 def etag(f):
     if 'etag' in f.headers.keys():
         return f.headers['etag']
-    return hashlib.md5(f.read()).hexdigest()
+    (digest, truncated) = fingerprint(f, options['maxbytes'], options['hash'])
+    if truncated:
+        return digest + TRUNCATED
+    return digest
+
+SCRIPT_RE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.I | re.S)
+COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+SPACE_RE = re.compile(r'\s+')
+
+def drop_selectors(text, selectors):
+    """ Removes every element matching any of the css selectors. Needs lxml,
+    which is only imported if someone asks for this. """
+    from lxml import html
+    from lxml import cssselect
+    if not text.strip():
+        return text
+    root = html.fromstring(text)
+    for s in selectors:
+        for e in cssselect.CSSSelector(s)(root):
+            e.drop_tree()
+    return html.tostring(root)
+
+def canonicalize(text, volatile=()):
+    """ Strips the bits of a page that change without the page changing:
+    scripts, styles, comments, anything matching the volatile regexes or
+    css: selectors, and differences in whitespace. """
+    selectors = [v[4:] for v in volatile if v.startswith('css:')]
+    if selectors:
+        text = drop_selectors(text, selectors)
+    text = SCRIPT_RE.sub('', text)
+    text = COMMENT_RE.sub('', text)
+    for v in volatile:
+        if not v.startswith('css:'):
+            text = re.sub(v, '', text)
+    return SPACE_RE.sub(' ', text).strip()
+
+def read_capped(f, max_bytes=None, chunk_size=CHUNK_SIZE):
+    """ Reads f a chunk at a time, up to max_bytes. Returns (text,
+    truncated). """
+    chunks = []
+    seen = 0
+    while max_bytes is None or seen < max_bytes:
+        if max_bytes is None:
+            chunk = f.read(chunk_size)
+        else:
+            chunk = f.read(min(chunk_size, max_bytes - seen))
+        if not chunk:
+            return (''.join(chunks), False)
+        chunks.append(chunk)
+        seen += len(chunk)
+    return (''.join(chunks), bool(f.read(1)))
+
+def normalized_etag(f, volatile=()):
+    """ Like etag(), but always hashes the content, and only after
+    canonicalize() has taken the noise out. """
+    (text, truncated) = read_capped(f, options['maxbytes'])
+    h = hashes[options['hash']]()
+    h.update(canonicalize(text, volatile))
+    if truncated:
+        return h.hexdigest() + TRUNCATED
+    return h.hexdigest()
+
+def volatile_patterns(row):
+    return [p.strip() for p in row.get('ignore', '').split(';') if p.strip()]
 
 def last_modified(f):
     if 'last-modified' in f.headers.keys():
@@ -36,6 +249,17 @@ def last_modified(f):
     return "Unknown"
 
 class WikiTable():
+    """ A mediawiki table, parsed once into a header, a list of column names
+    and a list of row dicts keyed on those names. Any text before or after
+    the table is kept, and comes back out when the table is turned back into
+    markup. Rows can be written one cell per line or inline, with || between
+    cells and !! between headings; they're always written back one cell per
+    line.
+
+    Give it a key column (eg 'url') and it keeps an index of rows by that
+    column, so rows can be looked up and changed in place. Changes made
+    through update_row, upsert and set_column are remembered, so callers can
+    ask what changed, or whether anything did, before writing it back. """
     @classmethod
     def _stringify(c, rows, header, fields, real_fields):
         """ Creates a Wiki markup table from a list of rows. The fields
@@ -43,75 +267,148 @@ class WikiTable():
         readable name at the top of the table. The two lists should map onto
         each other, and be in the order of the columns."""
 
-        s = header + '\n'
-        s += "|-\n"
-        for f in real_fields:
-            s += "!" + f + '\n'
+        lines = [header, '|-']
+        lines.extend(['!' + f for f in real_fields])
         for r in rows:
-                s += "|-\n"
-                row = []
-                for k in r:
-                    pos = fields.index(k)
-                    row.append( (pos, r[k]) )
-                row.sort(key=lambda s: s[0])
-                s += '\n'.join(['| '+r for (num, r) in row])
-        s += "\n|}"
-        return s
-
-
-    def __init__(self, wikimarkup):
+            lines.append('|-')
+            lines.extend(['| ' + r[f] for f in fields if f in r])
+        lines.append('|}')
+        return '\n'.join(lines)
+
+    @classmethod
+    def _field_name(c, real_field):
+        return re.sub('[^a-z]', '-', real_field.strip().lower())
+
+    def __init__(self, wikimarkup, key=None):
         self.wikimarkup = wikimarkup
+        self.key = key
+        self._parse()
+        self._reindex()
 
-    def wiki_to_dict(self):
-        tablemarkup = self.wikimarkup.split('\n')
-
-        fields = []
-        real_fields = []
-        rows = []
-        column = 0
-        row = {}
-        state = 'INIT'
-        for l in tablemarkup:
-            z = l.strip()
-            if z.startswith('{|'):
-                state = 'IN_TABLE'
-                self.header = z
-            if z.startswith('!') and (state == 'NEW_ROW'):
-                real_field = z[1:]
-                field = real_field.strip().lower()
-                field = re.sub('[^a-z]','-', field)
-                fields.append(field)
-                real_fields.append(real_field)
-            if z.startswith('|-'):
-                state = 'NEW_ROW'
-                if row:
-                    rows.append(row)
-                continue
+    def _reindex(self):
+        self.index = {}
+        self.dirty = set()
+        if self.key is None:
+            return
+        for (n, row) in enumerate(self.rows):
+            self.index.setdefault(row.get(self.key), n)
+
+    def _parse(self):
+        self.header = '{|'
+        self.before = []
+        self.after = []
+        self.fields = []
+        self.real_fields = []
+        self.rows = []
+        lines = self.wikimarkup.split('\n')
+        n = 0
+        while n < len(lines) and not lines[n].strip().startswith('{|'):
+            n += 1
+        if n == len(lines):
+            return
+        self.before = lines[:n]
+        self.header = lines[n].strip()
+        row = None
+        for n in range(n + 1, len(lines)):
+            z = lines[n].strip()
             if z.startswith('|}'):
-                if row:
-                    rows.append(row)
+                self.after = lines[n + 1:]
                 break
-            if z.startswith('|') and (state == 'NEW_ROW'):
-                column = 0
+            if z.startswith('|-'):
+                if row:
+                    self.rows.append(row)
                 row = {}
-                state = 'IN_ROW'
-            if z.startswith('|') and (state == 'IN_ROW'):
-                value = z[1:].strip()
-                row[fields[column]] = value
-                column += 1
-        self.real_fields = real_fields
-        self.fields = fields
-        self.rows = rows
+            elif z.startswith('!') and row == {} and not self.rows:
+                for real_field in z[1:].split('!!'):
+                    self.real_fields.append(real_field.rstrip())
+                    self.fields.append(WikiTable._field_name(real_field))
+            elif z.startswith('|') and row is not None:
+                for value in z[1:].split('||'):
+                    if len(row) < len(self.fields):
+                        row[self.fields[len(row)]] = value.strip()
+        if row:
+            self.rows.append(row)
+
+    def wiki_to_dict(self):
+        """ The table's rows, as dicts keyed on the lower-cased, hyphenated
+        column names. This is the table's own copy, not a fresh one. """
         return self.rows
 
+    def get_row(self, k):
+        """ The row whose key column is k, or None. """
+        if k in self.index:
+            return self.rows[self.index[k]]
+        return None
+
+    def _set(self, n, values):
+        row = self.rows[n]
+        for (field, value) in values.iteritems():
+            if row.get(field) != value:
+                row[field] = value
+                self.dirty.add(n)
+
+    def update_row(self, k, values):
+        """ Sets the columns in the values dict on the row keyed k. Raises
+        KeyError if there isn't one. """
+        self._set(self.index[k], values)
+
+    def upsert(self, row):
+        """ Updates the row with the same key as this one, or adds it to the
+        end of the table if there isn't one. """
+        k = row[self.key]
+        if k in self.index:
+            self.update_row(k, row)
+        else:
+            self.index[k] = len(self.rows)
+            self.dirty.add(len(self.rows))
+            self.rows.append(dict(row))
+
+    def set_column(self, field, values):
+        """ Sets one column in every row, from a list in row order. """
+        for (n, value) in enumerate(values):
+            self._set(n, {field: value})
+
+    def changed_rows(self):
+        """ The rows changed since the table was parsed, in table order. """
+        return [self.rows[n] for n in sorted(self.dirty)]
+
+    def is_dirty(self):
+        return bool(self.dirty)
+
+    def _wrap(self, table):
+        return '\n'.join(self.before + [table] + self.after)
+
     def __str__(self):
-        self.wiki_to_dict()
-        return WikiTable._stringify(self.rows, self.header, self.fields, self.real_fields)
+        return self._wrap(WikiTable._stringify(self.rows, self.header,
+            self.fields, self.real_fields))
+
+    def __eq__(self, other):
+        """ Same table, without turning either one back into markup. """
+        if not isinstance(other, WikiTable):
+            return NotImplemented
+        return (self.header == other.header and
+                self.real_fields == other.real_fields and
+                self.before == other.before and self.after == other.after and
+                self.rows == other.rows)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
 
     def copy_with_new_dict(self, d):
-        self.wiki_to_dict()
-        return WikiTable(WikiTable._stringify(d, self.header, self.fields, self.real_fields))
-        
+        new = WikiTable('', self.key)
+        new.header = self.header
+        new.before = self.before
+        new.after = self.after
+        new.fields = self.fields
+        new.real_fields = self.real_fields
+        new.rows = d
+        new.wikimarkup = None
+        new._reindex()
+        return new
+
 class WikiTableConversions(unittest.TestCase):
     def setUp(self):
         self.mup = '''{| class="wikitable"
@@ -158,6 +455,71 @@ class WikiTableConversions(unittest.TestCase):
         c = self.wikitext.copy_with_new_dict(b)
         self.assertEquals(str(c), changed)
 
+    def test_canReadInlineCells(self):
+        wt = WikiTable('''{| class="wikitable"
+|-
+! URL !! Etag !! Last Modified
+|-
+| http://example.com/ || foo || bar
+|-
+| http://example.org/
+| baz
+| quux
+|}''')
+        self.assertEquals(wt.fields, ['url', 'etag', 'last-modified'])
+        self.assertEquals(wt.wiki_to_dict()[0],
+            {'url': 'http://example.com/', 'etag': 'foo', 'last-modified': 'bar'})
+        self.assertEquals(wt.wiki_to_dict()[1]['last-modified'], 'quux')
+        self.assertEquals(WikiTable(str(wt)), wt)
+
+    def test_keepsTextAroundTheTable(self):
+        mup = 'Watched pages:\n' + self.mup + '\n[[Category:Bots]]'
+        self.assertEquals(str(WikiTable(mup)), mup)
+
+    def test_comparesWithoutReserializing(self):
+        b = copy.deepcopy(self.wikitext.wiki_to_dict())
+        self.assertEquals(self.wikitext.copy_with_new_dict(b), self.wikitext)
+        b[0]['etag'] = 'changed'
+        self.assertNotEqual(self.wikitext.copy_with_new_dict(b), self.wikitext)
+
+class WikiTableIndex(unittest.TestCase):
+    def setUp(self):
+        self.wt = WikiTable('''{| class="wikitable"
+|-
+! URL !! Etag !! Last Modified
+|-
+| http://example.com/ || foo || bar
+|-
+| http://example.org/ || baz || quux
+|}''', key='url')
+
+    def test_canLookUpRowsByKey(self):
+        self.assertEquals(self.wt.get_row('http://example.org/')['etag'], 'baz')
+        self.assertEquals(self.wt.get_row('http://example.net/'), None)
+
+    def test_updatingToTheSameValueIsNotAChange(self):
+        self.wt.update_row('http://example.com/', {'etag': 'foo'})
+        self.wt.set_column('last-modified', ['bar', 'quux'])
+        self.assertFalse(self.wt.is_dirty())
+
+    def test_changesAreTracked(self):
+        self.wt.update_row('http://example.org/', {'etag': 'new'})
+        self.assertTrue(self.wt.is_dirty())
+        self.assertEquals(self.wt.changed_rows(),
+                [self.wt.get_row('http://example.org/')])
+        self.assertIn('| new', str(self.wt))
+
+    def test_upsertAddsNewRows(self):
+        self.wt.upsert({'url': 'http://example.net/', 'etag': 'x',
+            'last-modified': 'y'})
+        self.wt.upsert({'url': 'http://example.com/', 'etag': 'z'})
+        self.assertEquals(len(self.wt.wiki_to_dict()), 3)
+        self.assertEquals(self.wt.get_row('http://example.com/')['etag'], 'z')
+        self.assertEquals(len(self.wt.changed_rows()), 2)
+
+    def test_unknownKeysRaise(self):
+        self.assertRaises(KeyError, self.wt.update_row, 'nope', {})
+
 class ReturnAnETag(unittest.TestCase):
     def setUp(self):
         self.f1 = 'file://' + os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)),'t/non-identical-file1.html'))
@@ -188,22 +550,599 @@ class ReturnAnETag(unittest.TestCase):
         del m.headers['last-modified']
         self.assertEquals(last_modified(m), 'Unknown')
 
-import copy
+def host_of(row):
+    """ Groups rows by host for the per-host connection limit. """
+    return urlparse.urlparse(row['url'])[1].lower()
+
+def open_url(url, method='GET', headers={}):
+    """ Opens url with the given method and extra headers, over a kept-alive
+    connection from the shared pool. A 304 Not Modified is handed back as a
+    response with code 304 rather than raised. """
+    return transport.open(url, method, headers)
+
+def conditional_headers(old_etag, old_last_modified):
+    """ Validators to send, built from what's already in the table. Our own
+    content hashes aren't real etags, so only quoted ones are sent back. """
+    headers = {}
+    if old_etag.startswith('"') or old_etag.startswith('W/"'):
+        headers['If-None-Match'] = old_etag
+    if old_last_modified and old_last_modified != 'Unknown':
+        headers['If-Modified-Since'] = old_last_modified
+    return headers
+
+def not_modified(f):
+    return getattr(f, 'code', None) == 304
+
+def check_url(row):
+    """ Returns the new (etag, last_modified) for a row. Asks with a
+    conditional HEAD first, and only GETs the body (to hash it) when the
+    server doesn't give us an etag or an unchanged last-modified date.
+    Normalized rows ignore the server's etag and keep their old values
+    unless the cleaned-up content has changed. """
+    old = (row.get('etag', ''), row.get('last-modified', ''))
+    volatile = volatile_patterns(row)
+    normalize = options['normalize'] or bool(volatile)
+    headers = conditional_headers(*old)
+    if normalize:
+        headers.pop('If-None-Match', None)
+    try:
+        f = open_url(row['url'], 'HEAD', headers)
+    except urllib2.HTTPError, e:
+        if e.code not in (405, 501):
+            raise
+        f = None
+    if f is not None:
+        if not_modified(f):
+            return old
+        if 'etag' in f.headers.keys() and not normalize:
+            return (etag(f), last_modified(f))
+        if last_modified(f) != 'Unknown' and last_modified(f) == old[1]:
+            return old
+    url_connection = open_url(row['url'], 'GET', headers)
+    try:
+        if not_modified(url_connection):
+            return old
+        if normalize:
+            new_etag = normalized_etag(url_connection, volatile)
+            if new_etag == old[0]:
+                return old
+            return (new_etag, last_modified(url_connection))
+        return (etag(url_connection), last_modified(url_connection))
+    finally:
+        url_connection.close()
+
+Check = collections.namedtuple('Check', 'etag last_modified elapsed status')
+
+def unchecked(row, status):
+    """ A row's old values, for when we couldn't check it. """
+    return Check(row.get('etag', ''), row.get('last-modified', ''), None,
+            status)
+
+def timed_check(row):
+    start = time.time()
+    host = host_of(row)
+    reason = breaker.skip(row['url'], host, start)
+    if reason:
+        return unchecked(row, reason)
+    try:
+        (e, lm) = check_url(row)
+    except Exception, err:
+        print >>sys.stderr, "www_watch: %s: %s" % (row['url'], err)
+        breaker.failed(row['url'], host, time.time())
+        return unchecked(row, 'failing')
+    breaker.succeeded(row['url'], host)
+    return Check(e, lm, time.time() - start, 'ok')
+
+def check_all(rows, deadline=None):
+    """ Fetches every row's url, options['workers'] at a time with no more
+    than options['perhost'] at once to the same host. Returns a Check for
+    each row, in the same order as rows. Rows not done by the deadline are
+    left with their old values, and marked stale. """
+    results = workpool.map_ordered(timed_check, rows, options['workers'],
+            key=host_of, per_key=options['perhost'], deadline=deadline)
+    return [c or unchecked(row, 'stale') for (row, c) in zip(rows, results)]
+
+def budget_deadline(start):
+    if options['budget'] is None:
+        return None
+    return start + options['budget']
+
+def record_checks(store, rows, results):
+    if store is None:
+        return
+    for (row, c) in zip(rows, results):
+        if c.status == 'ok':
+            store.record(row['url'], c.etag, c.last_modified, c.elapsed)
+    breaker.save(store)
+    store.commit()
+
+def summary(results):
+    """ A line about the rows we couldn't check, or None if there weren't
+    any. """
+    count = {}
+    for c in results:
+        count[c.status] = count.get(c.status, 0) + 1
+    if count.get('ok', 0) == len(results):
+        return None
+    return ("www_watch: of %d urls, %d ran out of time and %d failed; "
+            "skipped %d backing off and %d on hosts that are down. "
+            "They kept their old values." % (len(results),
+                count.get('stale', 0), count.get('failing', 0),
+                count.get('backoff', 0), count.get('host down', 0)))
+
+def update_tables(tables, store=None, deadline=None):
+    """ Checks the rows of all the tables in one batch, and updates each table
+    in place with its own results, which are returned. """
+    rows = []
+    for wt in tables:
+        rows.extend(wt.wiki_to_dict())
+    results = check_all(rows, deadline)
+    record_checks(store, rows, results)
+    start = 0
+    for wt in tables:
+        these = results[start:start + len(wt.wiki_to_dict())]
+        start += len(these)
+        wt.set_column('etag', [c.etag for c in these])
+        wt.set_column('last-modified', [c.last_modified for c in these])
+        if 'status' in wt.fields:
+            wt.set_column('status', [c.status for c in these])
+    return results
+
+class Schedule:
+    """ When each url is next due to be checked, as a heap of (due, key).
+    Every time a url is checked its interval halves if it changed and grows
+    by half if it didn't, staying between min_interval and max_interval. """
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.heap = []
+        self.interval = {}
+
+    def add(self, key, now):
+        """ Schedules a new key, due straight away. Known keys are left be. """
+        if key not in self.interval:
+            self.interval[key] = self.min_interval
+            heapq.heappush(self.heap, (now, key))
+
+    def remove(self, key):
+        """ Forgets a key; its entry in the heap is dropped when it's due. """
+        self.interval.pop(key, None)
+
+    def next_due(self):
+        if self.heap:
+            return self.heap[0][0]
+        return None
+
+    def due(self, now):
+        """ Pops and returns every key that's due by now. """
+        keys = []
+        while self.heap and self.heap[0][0] <= now:
+            (when, key) = heapq.heappop(self.heap)
+            if key in self.interval:
+                keys.append(key)
+        return keys
+
+    def reschedule(self, key, changed, now):
+        if key not in self.interval:
+            return
+        if changed:
+            i = max(self.min_interval, self.interval[key] / 2.0)
+        else:
+            i = min(self.max_interval, self.interval[key] * 1.5)
+        self.interval[key] = i
+        heapq.heappush(self.heap, (now + i, key))
+
+class ScheduleBacksOff(unittest.TestCase):
+    def setUp(self):
+        self.s = Schedule(10, 100)
+        self.s.add('a', 0)
+        self.s.add('b', 5)
+
+    def test_newKeysAreDueStraightAway(self):
+        self.assertEquals(self.s.due(0), ['a'])
+        self.assertEquals(self.s.due(5), ['b'])
+        self.assertEquals(self.s.next_due(), None)
+
+    def test_quietKeysBackOffUpToTheMaximum(self):
+        for n in range(10):
+            self.s.reschedule('a', False, 0)
+        self.assertEquals(self.s.interval['a'], 100)
+
+    def test_busyKeysTightenDownToTheMinimum(self):
+        self.s.interval['a'] = 80
+        self.s.reschedule('a', True, 0)
+        self.assertEquals(self.s.interval['a'], 40)
+        for n in range(10):
+            self.s.reschedule('a', True, 0)
+        self.assertEquals(self.s.interval['a'], 10)
+
+    def test_removedKeysAreNotDue(self):
+        self.s.remove('a')
+        self.assertEquals(self.s.due(10), ['b'])
+
+class BreakerSkipsDeadTargets(unittest.TestCase):
+    def setUp(self):
+        self.b = Breaker(backoff=10, host_failures=2, host_cooldown=100)
+
+    def test_failingUrlsBackOffExponentially(self):
+        self.b.failed('http://a/1', 'a', 0)
+        self.assertEquals(self.b.skip('http://a/1', 'a', 5), 'backoff')
+        self.assertEquals(self.b.skip('http://a/1', 'a', 10), None)
+        self.b.failed('http://b/1', 'b', 10)
+        self.b.succeeded('http://b/2', 'b')
+        self.b.failed('http://b/1', 'b', 10)
+        self.assertEquals(self.b.skip('http://b/1', 'b', 25), 'backoff')
+        self.assertEquals(self.b.skip('http://b/1', 'b', 30), None)
+
+    def test_hostsOpenAfterRepeatedFailures(self):
+        self.b.failed('http://a/1', 'a', 0)
+        self.b.failed('http://a/2', 'a', 0)
+        self.assertEquals(self.b.skip('http://a/3', 'a', 50), 'host down')
+        self.assertEquals(self.b.skip('http://b/1', 'b', 50), None)
+
+    def test_oneProbeIsLetThroughAfterCooldown(self):
+        self.b.failed('http://a/1', 'a', 0)
+        self.b.failed('http://a/2', 'a', 0)
+        self.assertEquals(self.b.skip('http://a/3', 'a', 100), None)
+        self.assertEquals(self.b.skip('http://a/4', 'a', 100), 'host down')
+        self.b.succeeded('http://a/3', 'a')
+        self.assertEquals(self.b.skip('http://a/4', 'a', 100), None)
+
+    def test_failedProbeReopensTheHost(self):
+        self.b.failed('http://a/1', 'a', 0)
+        self.b.failed('http://a/2', 'a', 0)
+        self.b.skip('http://a/3', 'a', 100)
+        self.b.failed('http://a/3', 'a', 100)
+        self.assertEquals(self.b.skip('http://a/4', 'a', 150), 'host down')
+
+class HashInChunks(unittest.TestCase):
+    def setUp(self):
+        self.f1 = os.path.join(os.path.dirname(os.path.realpath(__file__)),'t/non-identical-file1.html')
+        self.content = open(self.f1).read()
+
+    def test_chunkedHashMatchesWholeHash(self):
+        (digest, truncated) = fingerprint(open(self.f1), chunk_size=7)
+        self.assertEquals(digest, hashlib.md5(self.content).hexdigest())
+        self.assertFalse(truncated)
+
+    def test_stopsAtMaxBytes(self):
+        (digest, truncated) = fingerprint(open(self.f1), max_bytes=10)
+        self.assertEquals(digest, hashlib.md5(self.content[:10]).hexdigest())
+        self.assertTrue(truncated)
+
+    def test_exactlyMaxBytesIsNotTruncated(self):
+        (digest, truncated) = fingerprint(open(self.f1),
+                max_bytes=len(self.content))
+        self.assertFalse(truncated)
+
+    def test_crc32Mode(self):
+        (digest, truncated) = fingerprint(open(self.f1), hash='crc32')
+        self.assertEquals(digest,
+                '%08x' % (zlib.crc32(self.content) & 0xffffffff))
+
+class CanonicalizeNoise(unittest.TestCase):
+    def test_stripsScriptsStylesAndComments(self):
+        page = '<p>Hi</p><script type="x">var t = 1;</script>' + \
+            '<!-- served at 12:01 --><STYLE>p {}</STYLE>\n <p>there</p>'
+        self.assertEquals(canonicalize(page), '<p>Hi</p> <p>there</p>')
+
+    def test_stripsVolatileRegexes(self):
+        a = canonicalize('<p>Now: 12:01:33</p>', [r'\d\d:\d\d:\d\d'])
+        b = canonicalize('<p>Now: 17:45:02</p>', [r'\d\d:\d\d:\d\d'])
+        self.assertEquals(a, b)
+
+    def test_stripsCssSelectors(self):
+        try:
+            import lxml.cssselect
+        except ImportError:
+            self.skipTest("needs lxml")
+        a = canonicalize('<div><p>Same</p><div class="ad">Buy</div></div>',
+                ['css:div.ad'])
+        b = canonicalize('<div><p>Same</p><div class="ad">Sell</div></div>',
+                ['css:div.ad'])
+        self.assertEquals(a, b)
+
+    def test_rowPatternsComeFromTheIgnoreColumn(self):
+        self.assertEquals(volatile_patterns({'ignore': r'\d+ ; css:#ad;'}),
+                [r'\d+', 'css:#ad'])
+        self.assertEquals(volatile_patterns({}), [])
+
+class StoredPagesAreReread(unittest.TestCase):
+    def tearDown(self):
+        options['refresh'] = False
+
+    def test_onlyNewAndChangedPagesAreRead(self):
+        self.assertEquals(stale_pages({'A': 3, 'B': 5, 'C': 1},
+            {'A': 3, 'B': 4, 'D': 2}), ['B', 'C'])
+
+    def test_copiesWithoutRevisionsAreRead(self):
+        self.assertEquals(stale_pages({'A': 3}, {'A': None}), ['A'])
+
+    def test_refreshReadsEverything(self):
+        options['refresh'] = True
+        self.assertEquals(stale_pages({'A': 3, 'B': 5}, {'A': 3, 'B': 5}),
+                ['A', 'B'])
+
+class CheckUrl(unittest.TestCase):
+    def setUp(self):
+        self.f1 = 'file://' + os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)),'t/non-identical-file1.html'))
+        self.lm = last_modified(urllib2.urlopen(self.f1))
+
+    def test_unchangedLastModifiedKeepsOldEtag(self):
+        row = {'url': self.f1, 'etag': 'foo', 'last-modified': self.lm}
+        self.assertEquals(check_url(row), ('foo', self.lm))
+
+    def test_changedLastModifiedFetchesContent(self):
+        row = {'url': self.f1, 'etag': 'foo', 'last-modified': 'bar'}
+        self.assertEquals(check_url(row),
+                (etag(urllib2.urlopen(self.f1)), self.lm))
+
+    def test_onlyRealEtagsAreSentBack(self):
+        self.assertEquals(conditional_headers('abc123', 'Unknown'), {})
+        self.assertEquals(conditional_headers('"abc"', 'bar'),
+                {'If-None-Match': '"abc"', 'If-Modified-Since': 'bar'})
+
+    def test_onlyTablesWithChangesAreDirty(self):
+        table = '{|\n|-\n! URL\n! Etag\n! Last Modified\n|-\n| %s\n| foo\n| %s\n|}'
+        same = WikiTable(table % (self.f1, self.lm), key='url')
+        changed = WikiTable(table % (self.f1, 'bar'), key='url')
+        empty = WikiTable('No table here')
+        update_tables([same, changed, empty])
+        self.assertFalse(same.is_dirty())
+        self.assertTrue(changed.is_dirty())
+        self.assertFalse(empty.is_dirty())
+
+    def test_failuresKeepOldValues(self):
+        row = {'url': self.f1 + '-missing', 'etag': 'foo',
+                'last-modified': 'bar', 'status': 'ok'}
+        sys.stderr, stderr = StringIO.StringIO(), sys.stderr
+        try:
+            c = timed_check(row)
+        finally:
+            sys.stderr = stderr
+        self.assertEquals((c.etag, c.last_modified, c.status),
+                ('foo', 'bar', 'failing'))
+
+    def test_badIgnorePatternsOnlyFailTheirRow(self):
+        global breaker
+        row = {'url': self.f1, 'etag': 'foo', 'last-modified': 'bar',
+                'ignore': '(unclosed'}
+        sys.stderr, stderr = StringIO.StringIO(), sys.stderr
+        (breaker, old_breaker) = (Breaker(), breaker)
+        try:
+            c = timed_check(row)
+        finally:
+            sys.stderr = stderr
+            breaker = old_breaker
+        self.assertEquals((c.etag, c.status), ('foo', 'failing'))
+
+    def test_statusColumnIsFilledIn(self):
+        table = '{|\n|-\n! URL\n! Etag\n! Last Modified\n! Status\n|-\n| %s\n| foo\n| %s\n| \n|}'
+        wt = WikiTable(table % (self.f1, self.lm), key='url')
+        update_tables([wt])
+        self.assertEquals(wt.get_row(self.f1)['status'], 'ok')
+
+    def test_unchangedNormalizedContentKeepsOldValues(self):
+        f = urllib2.urlopen(self.f1)
+        h = normalized_etag(f, ['second'])
+        row = {'url': self.f1, 'etag': h, 'last-modified': 'bar',
+                'ignore': 'second'}
+        self.assertEquals(check_url(row), (h, 'bar'))
+
+def watchlist_pages(site):
+    """ The pages holding the watchlist, with their text fetched in one go.
+    Pages that don't exist are left out. """
+    if options['index']:
+        pages = wikipedia.Page(site, options['index']).linkedPages()
+    elif options['prefix']:
+        pages = list(site.prefixindex(options['prefix']))
+    else:
+        pages = [wikipedia.Page(site, WATCHLIST)]
+    wikipedia.getall(site, pages)
+    found = []
+    for page in pages:
+        try:
+            page.get()
+            found.append(page)
+        except (wikipedia.NoPage, wikipedia.IsRedirectPage):
+            pass
+    return found
+
+def watchlist_query():
+    """ api.php parameters that pick out the pages holding the watchlist. """
+    if options['index']:
+        return {'generator': 'links', 'titles': options['index'],
+                'gpllimit': 'max'}
+    elif options['prefix']:
+        return {'generator': 'allpages', 'gapprefix': options['prefix'],
+                'gapnamespace': 0, 'gaplimit': 'max'}
+    return {'titles': WATCHLIST}
+
+def watchlist_revisions(site):
+    """ {title: latest revision id} for the pages holding the watchlist,
+    from one api.php query. Pages that don't exist, and redirects, are left
+    out. """
+    params = dict(watchlist_query(), action='query', prop='info',
+            format='json')
+    f = wikisession.shared(site).get(wikisession.api_url(site), params)
+    try:
+        data = json.load(f)
+    finally:
+        f.close()
+    revisions = {}
+    for info in data.get('query', {}).get('pages', {}).values():
+        if 'lastrevid' in info and 'redirect' not in info:
+            revisions[info['title']] = info['lastrevid']
+    return revisions
+
+def stale_pages(revisions, saved):
+    """ Titles of the watchlist pages to read from the wiki, given their
+    latest revisions and the revisions of the copies we have, both as
+    {title: revision}. """
+    return sorted([title for title in revisions
+        if options['refresh'] or saved.get(title) != revisions[title]])
+
+def schedule_tables(schedule, pages, tables, now):
+    """ Adds any new rows to the schedule, and drops any that have gone. """
+    keys = set()
+    for (page, wt) in zip(pages, tables):
+        for row in wt.wiki_to_dict():
+            keys.add((page.title(), row['url']))
+    for key in keys:
+        schedule.add(key, now)
+    for key in schedule.interval.keys():
+        if key not in keys:
+            schedule.remove(key)
+
+def load_tables(site, store=None):
+    """ The watchlist pages and their tables. Without a store they all come
+    from the wiki. With one, only the pages that are new or have a newer
+    revision than the store's copy are read from the wiki (and their copies
+    updated); copies of pages no longer on the watchlist are dropped. """
+    if store is None:
+        pages = watchlist_pages(site)
+        return (pages, [WikiTable(page.get(), key='url') for page in pages])
+    revisions = watchlist_revisions(site)
+    saved = store.pages()
+    markup = dict((title, m) for (title, m, r) in saved)
+    stale = [wikipedia.Page(site, title) for title in
+            stale_pages(revisions, dict((t, r) for (t, m, r) in saved))]
+    if stale:
+        wikipedia.getall(site, stale)
+    for page in stale:
+        try:
+            markup[page.title()] = page.get()
+        except (wikipedia.NoPage, wikipedia.IsRedirectPage):
+            del revisions[page.title()]
+            continue
+        store.save_page(page.title(), markup[page.title()],
+                revisions[page.title()])
+    for title in markup.keys():
+        if title not in revisions:
+            store.drop_page(title)
+            del markup[title]
+    store.commit()
+    pages = [wikipedia.Page(site, title) for title in sorted(markup)]
+    tables = [WikiTable(markup[page.title()], key='url') for page in pages]
+    return (pages, tables)
+
+def flush(site, pages, tables, store=None):
+    """ Saves the changed rows of each table, onto a fresh copy of its page
+    so that any edits made since we last looked are kept. Returns the
+    reloaded pages and tables, and keeps a copy of them in the store. """
+    old = dict((page.title(), wt) for (page, wt) in zip(pages, tables))
+    pages = watchlist_pages(site)
+    fresh = []
+    for page in pages:
+        wt = WikiTable(page.get(), key='url')
+        if page.title() in old:
+            for row in old[page.title()].changed_rows():
+                if wt.get_row(row['url']) is not None:
+                    wt.update_row(row['url'], dict((f, row[f]) for f in
+                        ('etag', 'last-modified', 'status') if f in row))
+        if wt.is_dirty():
+            page.put(str(wt), comment="www_watch spotted a page change")
+            wt = WikiTable(str(wt), key='url')
+        fresh.append(wt)
+    if store is not None:
+        revisions = watchlist_revisions(site)
+        for (page, wt) in zip(pages, fresh):
+            store.save_page(page.title(), str(wt),
+                    revisions.get(page.title()))
+        store.commit()
+    return (pages, fresh)
+
+def try_flush(site, pages, tables, store=None):
+    """ flush, but if saving fails, says so and hands back the tables as they
+    were, changed rows and all, so the next flush can try again. """
+    try:
+        return flush(site, pages, tables, store)
+    except Exception, e:
+        print >>sys.stderr, "www_watch: couldn't save the watchlist, " \
+                "will try again later: %s" % e
+        return (pages, tables)
+
+class FlushFailures(unittest.TestCase):
+    def test_failedFlushesKeepTheChangedRows(self):
+        global watchlist_pages
+        table = '{|\n|-\n! URL\n! Etag\n! Last Modified\n|-\n| http://a/\n| x\n| y\n|}'
+        wt = WikiTable(table, key='url')
+        wt.update_row('http://a/', {'etag': 'z'})
+
+        def down(site):
+            raise IOError('wiki is down')
+        sys.stderr, stderr = StringIO.StringIO(), sys.stderr
+        (watchlist_pages, old_watchlist_pages) = (down, watchlist_pages)
+        try:
+            (pages, tables) = try_flush(None, ['page'], [wt])
+        finally:
+            watchlist_pages = old_watchlist_pages
+            sys.stderr = stderr
+        self.assertEquals(pages, ['page'])
+        self.assertEquals(tables[0].changed_rows()[0]['etag'], 'z')
+
+def daemon(site, store=None):
+    """ Checks urls as they fall due, forever. If the wiki can't be read or
+    saved to, it tries again at the next --flush interval. """
+    while True:
+        try:
+            (pages, tables) = load_tables(site, store)
+            break
+        except Exception, e:
+            print >>sys.stderr, "www_watch: couldn't load the watchlist, " \
+                    "will try again later: %s" % e
+            time.sleep(options['flush'])
+    schedule = Schedule(options['mininterval'], options['maxinterval'])
+    last_flush = time.time()
+    schedule_tables(schedule, pages, tables, last_flush)
+    while True:
+        now = time.time()
+        tables_by_title = dict((page.title(), wt)
+                for (page, wt) in zip(pages, tables))
+        keys = schedule.due(now)
+        rows = [tables_by_title[title].get_row(url) for (title, url) in keys]
+        results = check_all(rows, budget_deadline(now))
+        record_checks(store, rows, results)
+        for ((title, url), row, c) in zip(keys, rows, results):
+            changed = ((c.etag, c.last_modified) !=
+                    (row.get('etag'), row.get('last-modified')))
+            values = {'etag': c.etag, 'last-modified': c.last_modified}
+            if 'status' in tables_by_title[title].fields:
+                values['status'] = c.status
+            tables_by_title[title].update_row(url, values)
+            schedule.reschedule((title, url), changed, now)
+        if summary(results):
+            print summary(results)
+        if now - last_flush >= options['flush']:
+            (pages, tables) = try_flush(site, pages, tables, store)
+            if options['stats']:
+                print transport.report()
+            schedule_tables(schedule, pages, tables, now)
+            last_flush = now
+        wake = last_flush + options['flush']
+        if schedule.next_due() is not None:
+            wake = min(wake, schedule.next_due())
+        time.sleep(max(0, wake - time.time()))
+
 def main(args):
+    start = time.time()
     site = wikipedia.getSite('en')
-    watch_list_page = wikipedia.Page(site, 'Secretaribot/Watchlist')
-    markup = watch_list_page.get()
-    wt = WikiTable(markup)
-    urls = wt.wiki_to_dict()
-    new_urls = copy.deepcopy(urls)
-    for i in new_urls:
-        this_url = i['url']
-        url_connection = urllib2.urlopen(this_url)
-        i['etag'] = etag(url_connection)
-        i['last-modified'] = last_modified(url_connection)
-    wt2 = wt.copy_with_new_dict(new_urls)
-    if str(wt2) != str(wt):
-        watch_list_page.put(str(wt2), comment="www_watch spotted a page change")
+    store = None
+    if options['store']:
+        store = watchstore.WatchStore(options['store'])
+        breaker.load(store)
+    if options['daemon']:
+        return daemon(site, store)
+    (pages, tables) = load_tables(site, store)
+    results = update_tables(tables, store, budget_deadline(start))
+    if summary(results):
+        print summary(results)
+    if [wt for wt in tables if wt.is_dirty()]:
+        flush(site, pages, tables, store)
+    if store is not None:
+        store.close()
+    if options['stats']:
+        print transport.report()
 
 
 import sys, getopt
@@ -214,17 +1153,24 @@ class Main():
         help (-h, --help) should be automatically created from module
         docstring and handler docstrings.
         test (-t, --test) will run all docstring and unittests it finds
+        options listed in takes_argument expect a value (--x=value)
         """
+    takes_argument = ['workers', 'perhost', 'maxbytes', 'hash', 'prefix',
+            'index', 'mininterval', 'maxinterval', 'flush', 'store', 'timeout',
+            'connecttimeout', 'budget', 'backoff', 'hostfailures',
+            'hostcooldown']
     class Usage(Exception):
         """ Use this to generate a Usage message """
         def __init__(self, msg):
             self.msg = msg
     def __init__(self):
         handlers  = [i[7:] for i in dir(self) if i.startswith('handle_') ]
-        self.shortopts = ''.join([i for i in handlers if len(i) == 1])
-        self.longopts = [i for i in handlers if (len(i) > 1)]
+        self.shortopts = ''.join([i + ':' * (i in self.takes_argument)
+            for i in handlers if len(i) == 1])
+        self.longopts = [i + '=' * (i in self.takes_argument)
+            for i in handlers if (len(i) > 1)]
     def handler(self, option):
-        i = 'handle_%s' % option.lstrip('-')
+        i = 'handle_%s' % option.lstrip('-').rstrip('=:')
         if hasattr(self, i):
             return getattr(self, i)
     def default_main(self, args):
@@ -233,7 +1179,7 @@ class Main():
         """ Shows this message """
         print sys.modules.get(__name__).__doc__
         descriptions = {}
-        for i in list(self.shortopts) + self.longopts:
+        for i in list(self.shortopts.replace(':', '')) + self.longopts:
             d = self.handler(i).__doc__
             if d in descriptions:
                 descriptions[d].append(i)
@@ -261,6 +1207,94 @@ class Main():
         sys.exit(0)
     handle_t = handle_test
 
+    def handle_workers(self, v):
+        """ Number of urls to fetch at once (default 8) """
+        options['workers'] = int(v)
+
+    def handle_perhost(self, v):
+        """ Number of urls to fetch at once from any one host (default 2) """
+        options['perhost'] = int(v)
+
+    def handle_maxbytes(self, v):
+        """ Only hash the first n bytes of pages without an etag """
+        options['maxbytes'] = int(v)
+
+    def handle_hash(self, v):
+        """ Hash to use on pages without an etag: md5 (default) or crc32.
+        Switching changes every made-up etag, so expect one big update. """
+        if v not in hashes:
+            raise self.Usage("--hash must be one of " + ', '.join(hashes))
+        options['hash'] = v
+
+    def handle_normalize(self, v):
+        """ Hash every page with scripts, styles and comments stripped out """
+        options['normalize'] = True
+
+    def handle_prefix(self, v):
+        """ Watch the tables on every page whose title starts with this """
+        options['prefix'] = v
+
+    def handle_index(self, v):
+        """ Watch the tables on every page linked from this page """
+        options['index'] = v
+
+    def handle_daemon(self, v):
+        """ Keep running, checking each url when it's due """
+        options['daemon'] = True
+
+    def handle_mininterval(self, v):
+        """ Seconds between checks of a url that keeps changing (default 600) """
+        options['mininterval'] = int(v)
+
+    def handle_maxinterval(self, v):
+        """ Seconds between checks of a url that never changes (default 86400) """
+        options['maxinterval'] = int(v)
+
+    def handle_flush(self, v):
+        """ Seconds between saves to the wiki in daemon mode (default 900) """
+        options['flush'] = int(v)
+
+    def handle_stats(self, v):
+        """ Print how many connections were opened and reused """
+        options['stats'] = True
+
+    def handle_store(self, v):
+        """ Keep a local record of every check in this SQLite file, and start
+        from the copy of the watchlist kept there """
+        options['store'] = v
+
+    def handle_refresh(self, v):
+        """ Read every watchlist page from the wiki, even if the store's
+        copy is up to date """
+        options['refresh'] = True
+
+    def handle_timeout(self, v):
+        """ Seconds to wait on any one read from a url (default 60) """
+        transport.timeout = float(v)
+
+    def handle_connecttimeout(self, v):
+        """ Seconds to wait to connect to a url (default 20) """
+        transport.connect_timeout = float(v)
+
+    def handle_budget(self, v):
+        """ Seconds the whole run can spend fetching; urls not done by then
+        keep their old values """
+        options['budget'] = float(v)
+
+    def handle_backoff(self, v):
+        """ Seconds to leave a url alone after it first fails; doubles with
+        each failure after that (default 300) """
+        breaker.backoff = float(v)
+
+    def handle_hostfailures(self, v):
+        """ Failures in a row before a whole host is skipped (default 3) """
+        breaker.host_failures = int(v)
+
+    def handle_hostcooldown(self, v):
+        """ Seconds to skip a failing host before trying it again (default
+        3600) """
+        breaker.host_cooldown = float(v)
+
     def run(self, main= None, argv=None):
         """ Execute main function, having stripped out options and called the
         responsible handler functions within the class. Main defaults to